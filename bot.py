@@ -11,6 +11,7 @@ import schedule
 from telegram import BotCommand, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 import threading
+from ticks import round_upbit_price
 
 
 # Load environment variables
@@ -84,10 +85,6 @@ def get_open_price():
         logger.error(f"Error fetching open price: {e}")
         return None
 
-# Round price for Upbit
-def round_upbit_price(price):
-    return round(price / 1000) * 1000
-
 # Command handler: /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("User %s started the bot.", update.effective_user.username)
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+EQUITY_HISTORY_DB = "equity_history.db"
+
+BALANCE_SAMPLE_INTERVAL = int(os.getenv("BALANCE_SAMPLE_INTERVAL", 60))  # seconds between samples, 0 disables the sampler
+BALANCE_SAMPLE_BATCH_SIZE = int(os.getenv("BALANCE_SAMPLE_BATCH_SIZE", 10))  # samples buffered before they are written
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 1500))  # the finest resolution returning at most this many points is used
+
+# Rollup resolutions in milliseconds, finest first
+RESOLUTIONS = {"1m": 60 * 1000, "1h": 60 * 60 * 1000, "1d": 24 * 60 * 60 * 1000}
+
+# How long samples are kept in milliseconds, None keeps them forever
+RETENTION = {
+    "raw": int(os.getenv("RAW_SAMPLE_RETENTION_DAYS", 2)) * RESOLUTIONS["1d"],
+    "1m": int(os.getenv("MINUTE_ROLLUP_RETENTION_DAYS", 30)) * RESOLUTIONS["1d"],
+    "1h": int(os.getenv("HOUR_ROLLUP_RETENTION_DAYS", 730)) * RESOLUTIONS["1d"],
+    "1d": None,
+}
+PRUNE_INTERVAL = 60 * 60  # seconds between retention passes
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- Database Functions ----------------
+def initialize_db():
+    """Initialize the equity history database."""
+    conn = sqlite3.connect(EQUITY_HISTORY_DB)
+    c = conn.cursor()
+    c.execute('''PRAGMA journal_mode=WAL''')  # the sampler writes while /history reads
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS samples (
+            timestamp INTEGER PRIMARY KEY,
+            equity REAL,
+            balances TEXT
+        )
+    ''')
+    for resolution in RESOLUTIONS:
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS equity_{resolution} (
+                bucket INTEGER PRIMARY KEY,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                samples INTEGER
+            )
+        ''')
+    conn.commit()
+    conn.close()
+
+def insert_samples(samples):
+    """Insert a batch of samples and fold them into every rollup in a single transaction."""
+    conn = sqlite3.connect(EQUITY_HISTORY_DB)
+    c = conn.cursor()
+    c.executemany('''
+        INSERT OR REPLACE INTO samples (timestamp, equity, balances)
+        VALUES (?, ?, ?)
+    ''', [(sample["timestamp"], sample["equity"], json.dumps(sample["balances"])) for sample in samples])
+    for resolution, bucket_size in RESOLUTIONS.items():
+        # Samples are in time order, so the last one of a bucket sets its close
+        c.executemany(f'''
+            INSERT INTO equity_{resolution} (bucket, open, high, low, close, samples)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT (bucket) DO UPDATE SET
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = excluded.close,
+                samples = samples + 1
+        ''', [(sample["timestamp"] - sample["timestamp"] % bucket_size, *([sample["equity"]] * 4)) for sample in samples])
+    conn.commit()
+    conn.close()
+
+def delete_expired_samples(now):
+    """Delete samples and rollups older than their retention."""
+    conn = sqlite3.connect(EQUITY_HISTORY_DB)
+    c = conn.cursor()
+    for resolution, retention in RETENTION.items():
+        if retention is None:
+            continue
+        if resolution == "raw":
+            c.execute('''DELETE FROM samples WHERE timestamp < ?''', (now - retention,))
+        else:
+            c.execute(f'''DELETE FROM equity_{resolution} WHERE bucket < ?''', (now - retention,))
+    conn.commit()
+    conn.close()
+
+def get_history(start, end, resolution=None):
+    """Retrieve the equity history between two timestamps in milliseconds.
+
+    Without a resolution the finest one that fits the range in HISTORY_MAX_POINTS points and still
+    covers its start is used, so long ranges are served from the hourly or daily rollups.
+    """
+    if resolution is None:
+        resolution = "1d"
+        now = int(time.time() * 1000)
+        candidates = [("raw", BALANCE_SAMPLE_INTERVAL * 1000)] if BALANCE_SAMPLE_INTERVAL > 0 else []  # no raw samples while sampling is disabled
+        for candidate, bucket_size in [*candidates, *RESOLUTIONS.items()]:
+            retention = RETENTION[candidate]
+            if (end - start) / bucket_size <= HISTORY_MAX_POINTS and (retention is None or start >= now - retention):
+                resolution = candidate
+                break
+
+    conn = sqlite3.connect(EQUITY_HISTORY_DB)
+    c = conn.cursor()
+    if resolution == "raw":
+        c.execute('''SELECT timestamp, equity, balances FROM samples WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp''', (start, end))
+        points = [{"timestamp": timestamp, "equity": equity, "balances": json.loads(balances)} for timestamp, equity, balances in c.fetchall()]
+    elif resolution in RESOLUTIONS:
+        c.execute(f'''
+            SELECT bucket, open, high, low, close FROM equity_{resolution}
+            WHERE bucket BETWEEN ? AND ? ORDER BY bucket
+        ''', (start - start % RESOLUTIONS[resolution], end))
+        keys = ["timestamp", "open", "high", "low", "close"]
+        points = [dict(zip(keys, row)) for row in c.fetchall()]
+    else:
+        conn.close()
+        raise ValueError(f"Unknown resolution '{resolution}'")
+    conn.close()
+    return resolution, points
+
+
+# ---------------- Sampler ----------------
+class EquitySampler(threading.Thread):
+    """Background thread sampling balances and equity at a fixed interval and writing them in batches."""
+
+    def __init__(self, fetch_sample, interval):
+        super().__init__(name="EquitySampler", daemon=True)
+        self.fetch_sample = fetch_sample
+        self.interval = interval
+        self.buffer = []
+        self.buffer_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.last_pruned_at = 0
+
+    def run(self):
+        logger.info(f"Equity sampler started, sampling every {self.interval} seconds.")
+        while not self.stopped.wait(self.interval):
+            try:
+                sample = self.fetch_sample()
+                with self.buffer_lock:
+                    self.buffer.append(sample)
+                    full = len(self.buffer) >= BALANCE_SAMPLE_BATCH_SIZE
+                if full:
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Error sampling equity: {e}")
+
+    def flush(self):
+        """Write the buffered samples and apply the retention policies when due."""
+        with self.buffer_lock:
+            samples, self.buffer = self.buffer, []
+        if samples:
+            insert_samples(samples)
+            logger.debug(f"Wrote {len(samples)} equity samples.")
+        if time.time() - self.last_pruned_at > PRUNE_INTERVAL:
+            delete_expired_samples(int(time.time() * 1000))
+            self.last_pruned_at = time.time()
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error writing equity samples on shutdown: {e}")
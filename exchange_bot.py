@@ -1,135 +1,516 @@
-import ccxt
+import atexit
+from contextlib import closing
 from dotenv import load_dotenv
+import equity_history
 from flask import Flask, request, jsonify
+import functools
 import logging
-from logging.handlers import RotatingFileHandler
-import numpy as np
+from log_config import configure_logging
 import os
+import paper_exchange
+from profiling import init_profiling, profile_rpc
+import readiness
+import rpc
 import sqlite3
+import threading
+from ticks import UPBIT_KRW_TICK_SIZES
+import time
+import venues
 
 # Load environment variables
 load_dotenv()
 
 UPBIT_ACCESS_KEY = os.getenv("UPBIT_ACCESS_KEY")
 UPBIT_SECRET_KEY = os.getenv("UPBIT_SECRET_KEY")
-ORDER_TRACKER_DB = "order_tracker.db"
+DEFAULT_MARKET = "BTC/KRW"
+VENUES = [venue.strip() for venue in os.getenv("VENUES", "").split(",") if venue.strip()]  # additional ccxt exchange ids to route rungs to, Upbit is always the primary venue
+
+# Paper trading swaps the exchange for an in-memory matching engine driven by a recorded trade stream
+PAPER_TRADING = os.getenv("PAPER_TRADING", "false").lower() == "true"
+PAPER_REPLAY_FILE = os.getenv("PAPER_REPLAY_FILE")  # CSV file with timestamp, symbol and price columns
+PAPER_REPLAY_SPEED = float(os.getenv("PAPER_REPLAY_SPEED", 1.0))  # 1 to 1000 times the recorded pace, 0 replays as fast as possible
+PAPER_STARTING_KRW = float(os.getenv("PAPER_STARTING_KRW", 1_000_000))
+
+ORDER_TRACKER_DB = "paper_order_tracker.db" if PAPER_TRADING else "order_tracker.db"
+
+EXCHANGE_BOT_PORT = int(os.getenv("EXCHANGE_BOT_PORT", 5000))
+EXCHANGE_RPC_PORT = int(os.getenv("EXCHANGE_RPC_PORT", 0))  # msgpack RPC port for the other bots, 0 disables it
+
+RELADDER_TOLERANCE = float(os.getenv("RELADDER_TOLERANCE", 0.001))  # relative price/size change that makes a rung stale
+
+MARKETS_CACHE_TTL = int(os.getenv("MARKETS_CACHE_TTL", 3600))  # seconds before the market metadata is reloaded
+UPBIT_MIN_ORDER_VALUE = 5000  # KRW, used when the market metadata does not report a minimum
+UPBIT_MAX_ORDER_VALUE = 1_000_000_000  # KRW, used when the market metadata does not report a maximum
+UPBIT_KRW_PRICE_LEVELS, UPBIT_KRW_TICK_SIZES = zip(*UPBIT_KRW_TICK_SIZES)  # split for a vectorized lookup of each price's level
 
 # Configure logging
-log_file = "exchange_bot.log"
-log_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=5)
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG,
-    handlers=[log_handler]
-)
+configure_logging("exchange_bot.log")
 logger = logging.getLogger(__name__)
 
 # Initialize Upbit
-upbit = ccxt.upbit({
-    'apiKey': UPBIT_ACCESS_KEY,
-    'secret': UPBIT_SECRET_KEY,
-})
+if PAPER_TRADING:
+    upbit = paper_exchange.PaperExchange({"KRW": PAPER_STARTING_KRW})
+    equity_history.EQUITY_HISTORY_DB = "paper_equity_history.db"  # keep simulated equity out of the live history
+    logger.warning("Paper trading mode, no orders are sent to Upbit.")
+else:
+    upbit = venues.create_client("upbit", UPBIT_ACCESS_KEY, UPBIT_SECRET_KEY)
+
+if PAPER_TRADING and VENUES:
+    logger.warning(f"Paper trading only simulates Upbit, ignoring venues {', '.join(VENUES)}.")
+    VENUES = []
+router = venues.VenueRouter({"upbit": upbit, **{venue: venues.create_client(venue) for venue in VENUES}}, MARKETS_CACHE_TTL)
+
+# One lock per market, so a re-ladder cannot interleave with the place or cancel of the same ladder
+ladder_locks = {}
+ladder_locks_lock = threading.Lock()
 
 # Initialize Flask app
 app = Flask(__name__)
+init_profiling(app)
 
 # ---------------- Database Functions ----------------
+ORDERS_TABLE = '''
+    CREATE TABLE {table} (
+        id TEXT,
+        percentage_dip REAL,
+        price REAL,
+        amount REAL,
+        created_at TIMESTAMP,
+        market TEXT DEFAULT 'BTC/KRW',
+        venue TEXT DEFAULT 'upbit',
+        PRIMARY KEY (venue, id)
+    )
+'''
+
 def initialize_db():
     """Initialize the order_tracker database."""
-    conn = sqlite3.connect(ORDER_TRACKER_DB)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id TEXT PRIMARY KEY,
-            percentage_dip REAL,
-            price REAL,
-            amount REAL,
-            created_at TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def insert_order(order_id, percentage_dip, price, amount, created_at):
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute(ORDERS_TABLE.format(table="IF NOT EXISTS orders"))
+        # Orders tracked before markets and venues were configurable are all BTC/KRW orders on Upbit
+        columns = {column[1]: column for column in c.execute('''PRAGMA table_info(orders)''')}
+        if "market" not in columns:
+            c.execute("ALTER TABLE orders ADD COLUMN market TEXT DEFAULT 'BTC/KRW'")
+        if "venue" not in columns:
+            c.execute("ALTER TABLE orders ADD COLUMN venue TEXT DEFAULT 'upbit'")
+        if "venue" not in columns or not columns["venue"][5]:  # 5 is the column's position in the primary key
+            # Order ids are only unique per venue, rebuild a table keyed on the id alone
+            c.execute('''ALTER TABLE orders RENAME TO orders_by_id''')
+            c.execute(ORDERS_TABLE.format(table="orders"))
+            c.execute('''
+                INSERT INTO orders (id, percentage_dip, price, amount, created_at, market, venue)
+                SELECT id, percentage_dip, price, amount, created_at, market, venue FROM orders_by_id
+            ''')
+            c.execute('''DROP TABLE orders_by_id''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS ladders (
+                market TEXT PRIMARY KEY,
+                reference_price REAL,
+                updated_at TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+def insert_order(order_id, percentage_dip, price, amount, created_at, market, venue):
     """Insert a new order into the database."""
-    conn = sqlite3.connect(ORDER_TRACKER_DB)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO orders (id, percentage_dip, price, amount, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (order_id, percentage_dip, price, amount, created_at))
-    conn.commit()
-    conn.close()
-    logger.info(f"Inserted new order {order_id} into the database.")
-
-def delete_order(order_id):
-    """Delete an order from the database."""
-    conn = sqlite3.connect(ORDER_TRACKER_DB)
-    c = conn.cursor()
-    c.execute('''DELETE FROM orders WHERE id = ?''', (order_id,))
-    conn.commit()
-    conn.close()
-    logger.info(f"Deleted order {order_id} from the database.")
-
-def get_order_by_id(order_id):
-    """Retrieve an order by id."""
-    conn = sqlite3.connect(ORDER_TRACKER_DB)
-    c = conn.cursor()
-    c.execute('''SELECT * FROM orders WHERE id = ?''', (order_id,))
-    row = c.fetchone()
-    conn.close()
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:  # closed on errors too, so a failed write releases the lock
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO orders (id, percentage_dip, price, amount, created_at, market, venue)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (order_id, percentage_dip, price, amount, created_at, market, venue))
+        conn.commit()
+    logger.debug(f"Inserted new order {order_id} into the database.", extra={"order_id": order_id, "venue": venue})
+
+def delete_order(order_id, venue):
+    """Delete an order of a venue from the database."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''DELETE FROM orders WHERE venue = ? AND id = ?''', (venue, order_id))
+        conn.commit()
+    logger.debug(f"Deleted order {order_id} from the database.", extra={"order_id": order_id, "venue": venue})
+
+def get_order_by_id(order_id, venue):
+    """Retrieve an order of a venue by id."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT id, percentage_dip, price, amount, market, venue FROM orders WHERE venue = ? AND id = ?''', (venue, order_id))
+        row = c.fetchone()
     # Convert each row into a dictionary
-    keys = ["id", "percentage_dip", "price", "amount"]
-    return [dict(zip(keys, row[:4]))]
-
-def get_orders():
-    """Retrieve all orders."""
-    conn = sqlite3.connect(ORDER_TRACKER_DB)
-    c = conn.cursor()
-    c.execute('''SELECT * FROM orders''')
-    rows = c.fetchall()
-    conn.close()
+    keys = ["id", "percentage_dip", "price", "amount", "market", "venue"]
+    return [dict(zip(keys, row))]
+
+def get_orders(market):
+    """Retrieve all orders of a market."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT id, percentage_dip, price, amount, market, venue FROM orders WHERE market = ?''', (market,))
+        rows = c.fetchall()
     # Convert each row into a dictionary
-    keys = ["id", "percentage_dip", "price", "amount"]
-    return [dict(zip(keys, row[:4])) for row in rows]
+    keys = ["id", "percentage_dip", "price", "amount", "market", "venue"]
+    return [dict(zip(keys, row)) for row in rows]
+
+def get_ladder_reference(market):
+    """Retrieve the reference price of the market's active ladder, or None if no ladder is active."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''SELECT reference_price FROM ladders WHERE market = ?''', (market,))
+        row = c.fetchone()
+    return row[0] if row else None
+
+def set_ladder_reference(market, reference_price, updated_at):
+    """Store the reference price the market's active ladder is anchored to."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT OR REPLACE INTO ladders (market, reference_price, updated_at)
+            VALUES (?, ?, ?)
+        ''', (market, reference_price, updated_at))
+        conn.commit()
+    logger.info(f"Anchored {market} ladder to reference price {reference_price}.")
+
+def clear_ladder_reference(market):
+    """Mark the market's ladder as inactive."""
+    with closing(sqlite3.connect(ORDER_TRACKER_DB)) as conn:
+        c = conn.cursor()
+        c.execute('''DELETE FROM ladders WHERE market = ?''', (market,))
+        conn.commit()
+    logger.info(f"Cleared {market} ladder reference price.")
 
 # ---------------- Helper Functions ----------------
-def get_open_price():
-    """Retrieve open price from exchange."""
-    try:
-        ticker = upbit.fetch_ticker("BTC/KRW")
-        return float(ticker["open"])
-    except Exception as e:
-        logger.error(f"Error fetching open price: {e}")
-        return None
+def get_reference_prices(market, field):
+    """Retrieve the primary venue's open or last price of a market and the last price of every venue, concurrently."""
+    tickers = router.fetch_tickers(market)
+    reference_price = tickers.get(router.primary, {}).get(field)
+    last_prices = {venue: float(ticker['last']) for venue, ticker in tickers.items() if ticker.get('last') is not None}
+    return (float(reference_price) if reference_price is not None else None), last_prices
 
-# ---------------- REST API Endpoints ----------------
-@app.route("/health", methods=["GET"])
-def health_check():
+def get_market_limits(symbol, venue="upbit"):
+    """Retrieve the order limits of a market from the cached market metadata.
+
+    Upbit's order value limits fill in for missing metadata on Upbit only, other venues are left unbounded.
+    """
+    default_min_cost, default_max_cost = (UPBIT_MIN_ORDER_VALUE, UPBIT_MAX_ORDER_VALUE) if venue == "upbit" else (0, float("inf"))
     try:
-        return jsonify({"status": "OK", "message": "The Flask app is running properly."}), 200
+        market = router.load_markets(venue)[symbol]
+        limits = market.get('limits', {})
+        amount_precision = market.get('precision', {}).get('amount')
+        return {
+            "min_cost": (limits.get('cost') or {}).get('min') or default_min_cost,
+            "max_cost": (limits.get('cost') or {}).get('max') or default_max_cost,
+            "min_amount": (limits.get('amount') or {}).get('min') or 0,
+            # ccxt reports precision either as decimal places or as a step size depending on its precision mode
+            "amount_step": amount_precision if amount_precision is not None and amount_precision < 1 else 10.0 ** -(amount_precision if amount_precision is not None else 8),
+        }
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return jsonify({"status": "ERROR", "message": "Health check failed."}), 500
+        logger.warning(f"Error loading {venue} market metadata for {symbol}, falling back to defaults: {e}")
+        return {"min_cost": default_min_cost, "max_cost": default_max_cost, "min_amount": 0, "amount_step": 1e-8}
 
-@app.route('/check_balances', methods=['GET'])
-def check_balances():
+def round_to_tick(prices):
+    """Round KRW prices to the nearest tick of Upbit's tick-size table."""
+    import numpy as np  # imported on first use, it is a large part of the startup time
+    prices = np.asarray(prices, dtype=float)
+    tick_sizes = np.asarray(UPBIT_KRW_TICK_SIZES)[np.clip(np.searchsorted(UPBIT_KRW_PRICE_LEVELS, prices, side='right') - 1, 0, None)]
+    return np.round(np.round(prices / tick_sizes) * tick_sizes, 8)  # the second round drops float noise from small ticks
+
+def get_price_rounder(symbol, venue):
+    """Return the function rounding a venue's ladder prices to its tick.
+
+    Upbit's tick-size table applies to Upbit only, and to stand-ins without ccxt market metadata.
+    Other venues round with ccxt from their market's price precision, which raises if it is unknown.
+    """
+    client = router.clients[venue]
+    if venue == "upbit" or not hasattr(client, "price_to_precision"):
+        return round_to_tick
+
+    def round_to_venue_tick(prices):
+        import numpy as np
+        router.load_markets(venue)  # ccxt needs the market's precision in memory
+        return np.array([float(client.price_to_precision(symbol, price)) if price > 0 else 0.0 for price in np.asarray(prices, dtype=float).tolist()])
+    return round_to_venue_tick
+
+def build_ladder(reference_price, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment, market_limits, round_prices=round_to_tick):
+    """Compute and validate the target ladder rungs for a reference price.
+
+    Prices, amounts and limit checks are computed for the whole ladder at once. Returns the valid
+    rungs and a rejection report for the rest, without sending anything to the exchange.
+    """
+    import numpy as np
+    percentage_dips = np.arange(start_percentage_dip, end_percentage_dip + percentage_dip_increment, percentage_dip_increment)
+    prices = round_prices(reference_price * (1 - percentage_dips / 100))
+    costs = start_amount + (percentage_dips - start_percentage_dip) * amount_increment
+    amount_step = market_limits["amount_step"]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amounts = np.floor(np.where(prices > 0, costs / prices, 0) / amount_step) * amount_step  # truncate to the amount precision
+        amounts = np.round(amounts, 12)
+    order_values = prices * amounts
+
+    # Checks in order of precedence, the first failing one is reported
+    checks = [
+        (prices <= 0, "Price is not positive."),
+        (amounts <= 0, "Amount is zero after rounding to the amount precision."),
+        (amounts < market_limits["min_amount"], f"Amount is below the minimum of {market_limits['min_amount']}."),
+        (order_values < market_limits["min_cost"], f"Order value is below the minimum of {market_limits['min_cost']:,.0f} KRW."),
+        (order_values > market_limits["max_cost"], f"Order value is above the maximum of {market_limits['max_cost']:,.0f} KRW."),
+    ]
+    reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default="")
+
+    rungs, rejected_rungs = [], []
+    for percentage_dip, price, amount, reason in zip(percentage_dips.tolist(), prices.tolist(), amounts.tolist(), reasons.tolist()):
+        rung = {"percentage_dip": percentage_dip, "price": price, "amount": amount}
+        if reason:
+            rejected_rungs.append({**rung, "reason": reason})
+        else:
+            rungs.append(rung)
+    if rejected_rungs:
+        logger.warning(f"Rejected {len(rejected_rungs)} ladder rungs before sending: {rejected_rungs}")
+    return rungs, rejected_rungs
+
+def route_ladder(market, reference_price, last_prices, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment):
+    """Build the ladder on every quoted venue and route each rung to the venue with the lowest price after fees.
+
+    The ladder is anchored to the primary venue's reference price. On the other venues it is shifted
+    by their current premium over the primary venue, from the last prices, since the venues' daily
+    opens are taken at different times of day. A rung is rejected only if it is rejected on every
+    venue, in which case the primary venue's reason is reported.
+    """
+    reference_prices = {router.primary: reference_price}
+    primary_last_price = last_prices.get(router.primary)
+    if primary_last_price:
+        reference_prices.update({venue: reference_price * last_price / primary_last_price for venue, last_price in last_prices.items() if venue != router.primary})
+    best_rungs, rejected_rungs_by_venue, best_costs = {}, {}, {}
+    for venue, venue_reference_price in sorted(reference_prices.items(), key=lambda item: item[0] != router.primary):
+        try:
+            rungs, rejected_rungs_by_venue[venue] = build_ladder(venue_reference_price, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment, get_market_limits(market, venue), get_price_rounder(market, venue))
+        except Exception as e:
+            logger.error(f"Not routing {market} rungs to {venue}: {e}")
+            continue
+        fee_rate = router.fee_rate(venue, market)
+        for rung in rungs:
+            key = rung_key(rung['percentage_dip'])
+            cost = rung['price'] * (1 + fee_rate)  # per unit bought, ties stay on the primary venue
+            if key not in best_costs or cost < best_costs[key]:
+                best_costs[key] = cost
+                best_rungs[key] = {**rung, "venue": venue}
+    rungs = sorted(best_rungs.values(), key=lambda rung: rung['percentage_dip'])
+    rejected_rungs = next(iter(rejected_rungs_by_venue.values()), [])
+    rejected_rungs = [rung for rung in rejected_rungs if rung_key(rung['percentage_dip']) not in best_rungs]
+    return rungs, rejected_rungs
+
+def rung_key(percentage_dip):
+    """Key used to match a rung against a stored order (dips from np.arange are not exact)."""
+    return round(percentage_dip, 6)
+
+def is_rung_changed(order, rung, tolerance):
+    """Check whether an order deviates from its target rung by more than the relative tolerance."""
+    return any(abs(rung[field] - order[field]) > tolerance * abs(order[field]) for field in ("price", "amount"))
+
+def diff_ladder(target_rungs, open_orders, filled_orders, tolerance):
+    """Diff the target ladder against the bot's orders.
+
+    Returns the open orders to cancel, the rungs to place and the open orders to keep.
+    Rungs that have already been filled are never placed again, and partly filled orders are
+    kept as they are, so a rung never buys more than its size.
+    """
+    open_orders_by_rung = {rung_key(order['percentage_dip']): order for order in open_orders}
+    filled_rungs = {rung_key(order['percentage_dip']) for order in filled_orders}
+    target_rungs_by_key = {rung_key(rung['percentage_dip']): rung for rung in target_rungs}
+
+    stale_orders, new_rungs, kept_orders = [], [], []
+    for key, rung in target_rungs_by_key.items():
+        if key in filled_rungs:
+            continue
+        open_order = open_orders_by_rung.get(key)
+        if open_order is None:
+            new_rungs.append(rung)
+        elif open_order.get('filled'):
+            kept_orders.append(open_order)
+        elif is_rung_changed(open_order, rung, tolerance):
+            stale_orders.append(open_order)
+            new_rungs.append(rung)
+        else:
+            kept_orders.append(open_order)
+    for key, order in open_orders_by_rung.items():
+        if key not in target_rungs_by_key:  # rungs dropped from the ladder
+            (kept_orders if order.get('filled') else stale_orders).append(order)
+    return stale_orders, new_rungs, kept_orders
+
+def split_orders_from_db(market):
+    """Split the bot's orders into the ones still open on their venue and the filled ones.
+
+    The venues holding orders are queried concurrently. Open orders carry the amount already
+    filled in `filled`. Orders on venues that are no longer configured are left out of both lists,
+    and so are the orders on venues that failed to answer, which are returned as the third list.
+    """
+    orders_from_db = get_orders(market)
+    unknown_venues = {order['venue'] for order in orders_from_db} - set(router.clients)
+    if unknown_venues:
+        logger.warning(f"Ignoring {market} orders on unconfigured venues {', '.join(sorted(unknown_venues))}.")
+        orders_from_db = [order for order in orders_from_db if order['venue'] in router.clients]
+
+    def fetch(venue, client):
+        try:
+            return {order['id']: order for order in client.fetch_open_orders(market)}  # might include other open orders not placed by the bot
+        except Exception as e:
+            logger.error(f"Error fetching {market} open orders from {venue}: {e}")
+            return None
+
+    open_orders_from_exchange = router.map(fetch, {order['venue'] for order in orders_from_db})
+    unchecked_orders = [order for order in orders_from_db if open_orders_from_exchange[order['venue']] is None]  # neither open nor filled as far as we know
+    orders_from_db = [order for order in orders_from_db if open_orders_from_exchange[order['venue']] is not None]
+    open_orders_from_db = [  # filter only the open orders placed by the bot
+        {**order, "filled": open_orders_from_exchange[order['venue']][order['id']].get('filled') or 0}
+        for order in orders_from_db if order['id'] in open_orders_from_exchange[order['venue']]
+    ]
+    filled_orders_from_db = [order for order in orders_from_db if order['id'] not in open_orders_from_exchange[order['venue']]]  # filter only the filled orders placed by the bot
+    return open_orders_from_db, filled_orders_from_db, unchecked_orders
+
+def get_failed_venues(unchecked_orders):
+    """List the venues whose orders could not be checked, for the response body."""
+    return sorted({order['venue'] for order in unchecked_orders})
+
+def place_rung(rung, market):
+    """Place a single ladder rung on its venue and save it to the database."""
+    venue = rung.get('venue', router.primary)
+    start = time.perf_counter()
+    order = router.clients[venue].create_limit_buy_order(market, rung['amount'], rung['price'])
+    latency_ms = (time.perf_counter() - start) * 1000
+    insert_order(order['id'], rung['percentage_dip'], order['price'], order['amount'], order['timestamp'], market, venue)  # Save the order to the database
+    logger.info(f"Placed order: {order['id']} - {rung['percentage_dip']}% dip on {venue}.", extra={
+        "order_id": order['id'], "market": market, "venue": venue, "percentage_dip": rung['percentage_dip'],
+        "price": order['price'], "amount": order['amount'], "latency_ms": round(latency_ms, 3)
+    })
+    return {
+        "order_id": order['id'],
+        "percentage_dip": rung['percentage_dip'],
+        "price": order['price'],
+        "amount": order['amount'],
+        "venue": venue
+    }
+
+def cancel_order(open_order):
+    """Cancel a single order placed by the bot and remove it from the database."""
+    order_id = open_order['id']
+    start = time.perf_counter()
+    router.clients[open_order['venue']].cancel_order(order_id, open_order['market'])
+    latency_ms = (time.perf_counter() - start) * 1000
+    delete_order(order_id, open_order['venue'])
+    logger.info(f"Cancelled order '{order_id}' on {open_order['venue']}", extra={
+        "order_id": order_id, "market": open_order['market'], "venue": open_order['venue'], "percentage_dip": open_order['percentage_dip'], "latency_ms": round(latency_ms, 3)
+    })
+    return {
+        "order_id": order_id,
+        "percentage_dip": open_order['percentage_dip'],
+        "price": open_order['price'],
+        "amount": open_order['amount'] - open_order.get('filled', 0),  # the part that was not bought
+        "venue": open_order['venue']
+    }
+
+def place_rungs(rungs, market, on_order=None):
+    """Place rungs one after another on each venue, with the venues in parallel."""
+    def place(venue, client):
+        placed_orders = []
+        for rung in rungs_by_venue[venue]:
+            try:
+                placed_orders.append(place_rung(rung, market))
+                if on_order:
+                    on_order(placed_orders[-1])
+                # time.sleep(1)  # Add a small delay between consecutive orders to comply with API rate limits
+            except Exception as e:
+                logger.error(f"Failed to place order for {rung['percentage_dip']}% dip on {venue}: {e}")
+        return placed_orders
+
+    rungs_by_venue = {}
+    for rung in rungs:
+        rungs_by_venue.setdefault(rung.get('venue', router.primary), []).append(rung)
+    placed_orders = [order for orders in router.map(place, rungs_by_venue).values() for order in orders]
+    return sorted(placed_orders, key=lambda order: order['percentage_dip'])
+
+def cancel_orders_on_venues(open_orders):
+    """Cancel orders one after another on each venue, with the venues in parallel."""
+    def cancel(venue, client):
+        cancelled_orders = []
+        for open_order in open_orders_by_venue[venue]:
+            try:
+                cancelled_orders.append(cancel_order(open_order))
+                # time.sleep(1)  # Add a small delay between consecutive orders to comply with API rate limits
+            except Exception as e:
+                logger.error(f"Failed to cancel order '{open_order['id']}' on {venue}: {e}")
+        return cancelled_orders
+
+    open_orders_by_venue = {}
+    for open_order in open_orders:
+        open_orders_by_venue.setdefault(open_order['venue'], []).append(open_order)
+    cancelled_orders = [order for orders in router.map(cancel, open_orders_by_venue).values() for order in orders]
+    return sorted(cancelled_orders, key=lambda order: order['percentage_dip'])
+
+def fetch_total_balances():
+    """Fetch the balances of every venue concurrently and add them up per asset.
+
+    Returns the balances and the venues that failed, whose balances are left out.
+    """
+    def fetch(venue, client):
+        try:
+            return client.fetch_balance()
+        except Exception as e:
+            logger.error(f"Error fetching balance from {venue}: {e}")
+            return None
+
+    balances, failed_venues = {}, []
+    for venue, balance in router.map(fetch).items():
+        if balance is None:
+            failed_venues.append(venue)
+            continue
+        for asset, amount in balance.get('total', {}).items():
+            if amount:
+                balances[asset] = balances.get(asset, 0) + amount
+    if len(failed_venues) == len(router.clients):
+        raise RuntimeError("Failed to fetch balances from every venue.")
+    return {asset: amount for asset, amount in balances.items() if amount > 0}, failed_venues
+
+def fetch_equity_sample():
+    """Fetch the balances of all venues and value them in KRW at Upbit's last traded prices."""
+    balances, failed_venues = fetch_total_balances()
+    if failed_venues:
+        raise RuntimeError(f"Failed to fetch balances from {', '.join(failed_venues)}.")  # a partial sample would show as an equity drop
+    markets = upbit.load_markets()
+    symbols = [f"{asset}/KRW" for asset in balances if asset != "KRW" and f"{asset}/KRW" in markets]
+    tickers = upbit.fetch_tickers(symbols) if symbols else {}  # a single request for all held assets
+    equity = balances.get("KRW", 0) + sum(balances[symbol.split("/")[0]] * ticker['last'] for symbol, ticker in tickers.items())
+    return {"timestamp": upbit.milliseconds(), "equity": equity, "balances": balances}
+
+def warm_up():
+    """Load what the first ladder needs in the background, while the service starts serving."""
+    import numpy  # noqa: F401
+    router.warm_up()
+
+# ---------------- Order Operations ----------------
+# Shared by the REST API and the RPC server, each returns the response body and HTTP status.
+# Operations that place orders report every placed order through `on_order` as soon as it is placed.
+def serialize_by_market(operation):
+    """Run the ladder operations of a market one at a time, whether they come over REST or RPC."""
+    @functools.wraps(operation)
+    def wrapper(data, *args, **kwargs):
+        market = data.get("market", DEFAULT_MARKET)
+        with ladder_locks_lock:
+            lock = ladder_locks.setdefault(market, threading.Lock())
+        with lock:
+            return operation(data, *args, **kwargs)
+    return wrapper
+
+def fetch_non_zero_balances(data):
     try:
-        # Fetch balances from Upbit
-        balance = upbit.fetch_balance()
-        non_zero_balances = {
-            asset: amount for asset, amount in balance.get('total', {}).items() if amount > 0
-        }
-        return jsonify({"non_zero_balances": non_zero_balances})
+        # Fetch balances from every venue
+        non_zero_balances, failed_venues = fetch_total_balances()
+        return {"non_zero_balances": non_zero_balances, "failed_venues": failed_venues}, 200
     except Exception as e:
         logger.error(f"Error fetching balances: {e}")
-        return jsonify({"error": "Failed to fetch balances"}), 500
+        return {"error": "Failed to fetch balances"}, 500
 
-@app.route("/place_orders", methods=["POST"])
-def place_orders():
+@serialize_by_market
+def place_ladder(data, on_order=None):
     try:
-        open_price = get_open_price()
-        data = request.json
+        market = data.get("market", DEFAULT_MARKET)
         start_percentage_dip = data.get("start_percentage_dip")
         end_percentage_dip = data.get("end_percentage_dip")
         percentage_dip_increment = data.get("percentage_dip_increment")
@@ -137,92 +518,274 @@ def place_orders():
         amount_increment = data.get("amount_increment")
 
         if None in (start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment):
-            return jsonify({"error": "Missing required parameters."}), 400
+            return {"error": "Missing required parameters."}, 400
+
+        open_price, last_prices = get_reference_prices(market, "open")  # the ladder is tracked against the primary venue's price
+        if open_price is None:
+            return {"error": "Failed to fetch reference price."}, 500
         
-        placed_orders = []
-        for percentage_dip in np.arange(start_percentage_dip, end_percentage_dip + percentage_dip_increment, percentage_dip_increment):
-            try:
-                price = round(open_price * (1 - percentage_dip / 100), -3)  # Round to the nearest thousands to comply with the exchange requirments
-                amount = (start_amount + (percentage_dip - start_percentage_dip) * amount_increment) / price
-                order = upbit.create_limit_buy_order("BTC/KRW", amount, price)
-                insert_order(order['id'], percentage_dip, order['price'], order['amount'], order['timestamp'])  # Save the order to the database
-                logger.info(f"Placed order: {order['id']} - {percentage_dip}% dip.")
-                placed_orders.append({
-                    "order_id": order['id'], 
-                    "percentage_dip": percentage_dip, 
-                    "price": order['price'], 
-                    "amount": order['amount']
-                })
-                # time.sleep(1)  # Add a small delay between consecutive orders to comply with API rate limits
-            except Exception as e:
-                logger.error(f"Failed to place order for {percentage_dip}% dip: {e}")
-        return jsonify({"placed_orders": placed_orders})
+        rungs, rejected_rungs = route_ladder(market, open_price, last_prices, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment)
+        placed_orders = place_rungs(rungs, market, on_order)
+        set_ladder_reference(market, open_price, upbit.milliseconds())
+        return {"placed_orders": placed_orders, "rejected_rungs": rejected_rungs}, 200
     except Exception as e:
         logger.error(f"Error placing orders: {e}")
-        return jsonify({"error": "Failed to place orders"}), 500
+        return {"error": "Failed to place orders"}, 500
 
-@app.route("/cancel_orders", methods=["POST"])
-def cancel_orders():
+def validate_ladder_rungs(data):
+    """Build the ladder and report the rungs that would be rejected, without placing any orders."""
     try:
-        open_orders_from_exchange = upbit.fetch_open_orders("BTC/KRW")  # might include other open orders not placed by the bot
-        open_order_ids_from_exchange = [order['id'] for order in open_orders_from_exchange]
-        orders_from_db = get_orders()
-        open_orders_from_db = [order for order in orders_from_db if order['id'] in open_order_ids_from_exchange]  # filter only the open orders placed by the bot
-        filled_orders_from_db = [order for order in orders_from_db if order['id'] not in open_order_ids_from_exchange]  # filter only the filled orders placed by the bot
+        market = data.get("market", DEFAULT_MARKET)
+        start_percentage_dip = data.get("start_percentage_dip")
+        end_percentage_dip = data.get("end_percentage_dip")
+        percentage_dip_increment = data.get("percentage_dip_increment")
+        start_amount = data.get("start_amount")
+        amount_increment = data.get("amount_increment")
 
-        cancelled_orders = []
-        for open_order in open_orders_from_db:
-            try:
-                order_id = open_order['id']
-                upbit.cancel_order(order_id)
-                delete_order(order_id)
-                logger.info(f"Cancelled order '{order_id}'")
-                cancelled_orders.append({
-                    "order_id": order_id, 
-                    "percentage_dip": open_order['percentage_dip'], 
-                    "price": open_order['price'], 
-                    "amount": open_order['amount']
-                })
-                # time.sleep(1)  # Add a small delay between consecutive orders to comply with API rate limits
-            except Exception as e:
-                logger.error(f"Failed to cancel order '{order_id}': {e}")
+        if None in (start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment):
+            return {"error": "Missing required parameters."}, 400
+
+        reference_price, last_prices = get_reference_prices(market, "open")
+        reference_price = data.get("reference_price") or reference_price  # an explicit reference price replaces the primary venue's open
+        if reference_price is None:
+            return {"error": "Failed to fetch reference price."}, 500
+
+        rungs, rejected_rungs = route_ladder(market, reference_price, last_prices, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment)
+        return {"reference_price": reference_price, "valid_rungs": rungs, "rejected_rungs": rejected_rungs}, 200
+    except Exception as e:
+        logger.error(f"Error validating ladder: {e}")
+        return {"error": "Failed to validate ladder"}, 500
+
+@serialize_by_market
+def reladder(data, on_order=None):
+    """Re-anchor the active ladder to a new reference price, replacing only the rungs that changed."""
+    try:
+        market = data.get("market", DEFAULT_MARKET)
+        start_percentage_dip = data.get("start_percentage_dip")
+        end_percentage_dip = data.get("end_percentage_dip")
+        percentage_dip_increment = data.get("percentage_dip_increment")
+        start_amount = data.get("start_amount")
+        amount_increment = data.get("amount_increment")
+        tolerance = data.get("tolerance", RELADDER_TOLERANCE)
+        price_move_threshold = data.get("price_move_threshold")  # in percent, skip the re-ladder for smaller price moves
+
+        if None in (start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment):
+            return {"error": "Missing required parameters."}, 400
+
+        current_reference_price = get_ladder_reference(market)
+        if current_reference_price is None:
+            return {"status": "No active ladder.", "cancelled_orders": [], "placed_orders": []}, 200
+
+        reference_price, last_prices = get_reference_prices(market, "last")
+        reference_price = data.get("reference_price") or reference_price  # an explicit reference price replaces the primary venue's last price
+        if reference_price is None:
+            return {"error": "Failed to fetch reference price."}, 500
+
+        price_move = abs(reference_price - current_reference_price) * 100 / current_reference_price
+        if price_move_threshold is not None and price_move < price_move_threshold:
+            return {"status": f"Price moved {price_move:.2f}%, below the threshold.", "cancelled_orders": [], "placed_orders": []}, 200
 
-        filled_orders = []
+        target_rungs, rejected_rungs = route_ladder(market, reference_price, last_prices, start_percentage_dip, end_percentage_dip, percentage_dip_increment, start_amount, amount_increment)
+        open_orders_from_db, filled_orders_from_db, unchecked_orders = split_orders_from_db(market)
+        # A rung on a venue that did not answer may still be open or filled, so it is left alone
+        unchecked_rungs = {rung_key(order['percentage_dip']) for order in unchecked_orders}
+        target_rungs = [rung for rung in target_rungs if rung_key(rung['percentage_dip']) not in unchecked_rungs]
+        stale_orders, new_rungs, kept_orders = diff_ladder(target_rungs, open_orders_from_db, filled_orders_from_db, tolerance)
+
+        # Cancel before placing so the released KRW can fund the replacement rungs
+        cancelled_orders = cancel_orders_on_venues(stale_orders)
+
+        uncancelled_rungs = {rung_key(order['percentage_dip']) for order in stale_orders} - {rung_key(order['percentage_dip']) for order in cancelled_orders}
+        new_rungs = [rung for rung in new_rungs if rung_key(rung['percentage_dip']) not in uncancelled_rungs]  # the old order is still live, do not double up the rung
+        placed_orders = place_rungs(new_rungs, market, on_order)
+
+        set_ladder_reference(market, reference_price, upbit.milliseconds())
+        logger.info(f"Re-laddered {market} at {reference_price}: cancelled {len(cancelled_orders)}, placed {len(placed_orders)}, kept {len(kept_orders)} orders.")
+        return {
+            "status": f"Re-laddered after a {price_move:.2f}% price move.",
+            "reference_price": reference_price,
+            "cancelled_orders": cancelled_orders,
+            "placed_orders": placed_orders,
+            "kept_orders": len(kept_orders),
+            "rejected_rungs": rejected_rungs,
+            "failed_venues": get_failed_venues(unchecked_orders)
+        }, 200
+    except Exception as e:
+        logger.error(f"Error re-laddering orders: {e}")
+        return {"error": "Failed to re-ladder orders"}, 500
+
+@serialize_by_market
+def cancel_ladder(data):
+    try:
+        market = data.get("market", DEFAULT_MARKET)
+        open_orders_from_db, filled_orders_from_db, unchecked_orders = split_orders_from_db(market)  # orders on venues that fail stay tracked for the next cancel
+        clear_ladder_reference(market)  # stop re-laddering once the ladder is torn down
+
+        cancelled_orders = cancel_orders_on_venues(open_orders_from_db)
+
+        # The filled part of a partly filled order counts as a fill once the rest is cancelled
+        cancelled_order_keys = {(order['venue'], order['order_id']) for order in cancelled_orders}  # order ids are only unique per venue
+        filled_orders = [
+            {"order_id": order['id'], "percentage_dip": order['percentage_dip'], "price": order['price'], "amount": order['filled'], "venue": order['venue']}
+            for order in open_orders_from_db if order['filled'] and (order['venue'], order['id']) in cancelled_order_keys
+        ]
         for filled_order in filled_orders_from_db:
             try:
                 order_id = filled_order['id']
-                delete_order(order_id)
+                delete_order(order_id, filled_order['venue'])
                 filled_orders.append({
                     "order_id": order_id, 
                     "percentage_dip": filled_order['percentage_dip'], 
                     "price": filled_order['price'], 
-                    "amount": filled_order['amount']
+                    "amount": filled_order['amount'],
+                    "venue": filled_order['venue']
                 })
             except Exception as e:
                 logger.error(f"Failed to process order '{order_id}': {e}")
         
-        return jsonify({"cancelled_orders": cancelled_orders, "filled_orders": filled_orders})
+        return {"cancelled_orders": cancelled_orders, "filled_orders": filled_orders, "failed_venues": get_failed_venues(unchecked_orders)}, 200
     except Exception as e:
         logger.error(f"Error cancelling orders: {e}")
-        return jsonify({"error": "Failed to cancel orders"}), 500
-    
-@app.route("/check_orders", methods=["GET"])
-def check_orders():
+        return {"error": "Failed to cancel orders"}, 500
+
+def fetch_open_ladder_orders(data):
     try:
-        open_orders_from_exchange = upbit.fetch_open_orders("BTC/KRW")  # might include other open orders not placed by the bot
-        open_order_ids_from_exchange = [order['id'] for order in open_orders_from_exchange]
-        orders_from_db = get_orders()
-        open_orders_from_db = [order for order in orders_from_db if order['id'] in open_order_ids_from_exchange]  # filter only the open orders placed by the bot
-        open_orders = [{"order_id": open_order['id'], "percentage_dip": open_order['percentage_dip'], "price": open_order['price'], "amount": open_order['amount']} for open_order in open_orders_from_db]
+        market = data.get("market", DEFAULT_MARKET)
+        open_orders_from_db, _, unchecked_orders = split_orders_from_db(market)
+        open_orders = [{"order_id": open_order['id'], "percentage_dip": open_order['percentage_dip'], "price": open_order['price'], "amount": open_order['amount'], "venue": open_order['venue']} for open_order in open_orders_from_db]
         
-        return jsonify({"open_orders": open_orders})
+        return {"open_orders": open_orders, "failed_venues": get_failed_venues(unchecked_orders)}, 200
     except Exception as e:
         logger.error(f"Error fetching orders: {e}")
-        return jsonify({"error": "Failed to fetch orders"}), 500
+        return {"error": "Failed to fetch orders"}, 500
+
+def fetch_venue_quotes(data):
+    """Quote a market on every venue concurrently, with the prices after fees the rungs are routed by."""
+    try:
+        market = data.get("market", DEFAULT_MARKET)
+
+        def quote(venue, client):
+            start = time.perf_counter()
+            try:
+                ticker = client.fetch_ticker(market)
+                order_book = client.fetch_order_book(market)
+            except Exception as e:
+                logger.error(f"Error quoting {market} on {venue}: {e}")
+                return {"error": str(e)}
+            fee_rate = router.fee_rate(venue, market)
+            return {
+                "open": ticker['open'],
+                "last": ticker['last'],
+                "bid": order_book['bids'][0][0] if order_book['bids'] else None,
+                "ask": order_book['asks'][0][0] if order_book['asks'] else None,
+                "fee_rate": fee_rate,
+                "last_after_fees": ticker['last'] * (1 + fee_rate),
+                "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+            }
+
+        start = time.perf_counter()
+        quotes = router.map(quote)
+        latency_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Quoted {market} on {len(quotes)} venues in {latency_ms:.1f} ms.", extra={"market": market, "latency_ms": round(latency_ms, 3)})
+        priced_venues = [venue for venue, venue_quote in quotes.items() if venue_quote.get("last_after_fees") is not None]
+        return {
+            "market": market,
+            "quotes": quotes,
+            "best_venue": min(priced_venues, key=lambda venue: quotes[venue]["last_after_fees"], default=None),
+            "latency_ms": round(latency_ms, 3)
+        }, 200
+    except Exception as e:
+        logger.error(f"Error quoting venues: {e}")
+        return {"error": "Failed to quote venues"}, 500
+
+# ---------------- REST API Endpoints ----------------
+@app.route("/health", methods=["GET"])
+def health_check():
+    try:
+        return jsonify({"status": "OK", "message": "The Flask app is running properly."}), 200
+    except Exception as e:
+        logger.error(f"Health check failed: {e}")
+        return jsonify({"status": "ERROR", "message": "Health check failed."}), 500
+
+@app.route('/check_balances', methods=['GET'])
+def check_balances():
+    body, status = fetch_non_zero_balances(request.args)
+    return jsonify(body), status
+
+@app.route('/history', methods=['GET'])
+def history():
+    try:
+        end = request.args.get("end", upbit.milliseconds(), type=int)
+        start = request.args.get("start", end - equity_history.RESOLUTIONS["1d"], type=int)
+        resolution, points = equity_history.get_history(start, end, request.args.get("resolution"))
+        return jsonify({"resolution": resolution, "points": points})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error fetching equity history: {e}")
+        return jsonify({"error": "Failed to fetch equity history"}), 500
+
+@app.route("/place_orders", methods=["POST"])
+def place_orders():
+    body, status = place_ladder(request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+@app.route("/validate_ladder", methods=["POST"])
+def validate_ladder():
+    body, status = validate_ladder_rungs(request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+@app.route("/reladder_orders", methods=["POST"])
+def reladder_orders():
+    body, status = reladder(request.get_json(silent=True) or {})
+    return jsonify(body), status
+
+@app.route("/cancel_orders", methods=["POST"])
+def cancel_orders():
+    body, status = cancel_ladder(request.get_json(silent=True) or {})
+    return jsonify(body), status
+    
+@app.route("/check_orders", methods=["GET"])
+def check_orders():
+    body, status = fetch_open_ladder_orders(request.args)
+    return jsonify(body), status
+
+@app.route("/quotes", methods=["GET"])
+def quotes():
+    body, status = fetch_venue_quotes(request.args)
+    return jsonify(body), status
 
+# ---------------- RPC Server ----------------
+rpc_server = rpc.RpcServer(profile_rpc({  # timed and profiled like the REST endpoints
+    "check_balances": fetch_non_zero_balances,
+    "place_orders": place_ladder,
+    "validate_ladder": validate_ladder_rungs,
+    "reladder_orders": reladder,
+    "cancel_orders": cancel_ladder,
+    "check_orders": fetch_open_ladder_orders,
+    "quotes": fetch_venue_quotes,
+}))
 
 # ---------------- Main Program ----------------
 if __name__ == "__main__":
+    if PAPER_TRADING and os.path.exists(ORDER_TRACKER_DB):
+        os.remove(ORDER_TRACKER_DB)  # the paper engine starts without orders, so stale rows would be reported as fills
     initialize_db()
+    equity_history.initialize_db()
+    if equity_history.BALANCE_SAMPLE_INTERVAL > 0:
+        equity_sampler = equity_history.EquitySampler(fetch_equity_sample, equity_history.BALANCE_SAMPLE_INTERVAL)
+        equity_sampler.start()
+        atexit.register(equity_sampler.stop)  # write the buffered samples on shutdown
+    if PAPER_TRADING and PAPER_REPLAY_FILE:
+        threading.Thread(
+            target=paper_exchange.replay,
+            args=(upbit, paper_exchange.read_trades(PAPER_REPLAY_FILE), PAPER_REPLAY_SPEED),
+            name="PaperReplay",
+            daemon=True
+        ).start()
+        logger.info(f"Replaying {PAPER_REPLAY_FILE} at {PAPER_REPLAY_SPEED}x.")
+    if EXCHANGE_RPC_PORT:
+        rpc_server.serve("0.0.0.0", EXCHANGE_RPC_PORT)
+    threading.Thread(target=warm_up, name="WarmUp", daemon=True).start()
     logger.info("Exchange bot started with REST API.")
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    readiness.serve(app, "0.0.0.0", EXCHANGE_BOT_PORT, "exchange_bot")  # a single process, a reloader would start a second sampler
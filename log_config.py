@@ -0,0 +1,71 @@
+import atexit
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.1))  # fraction of DEBUG records kept, 1.0 keeps all
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including fields passed through `extra`."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in STANDARD_RECORD_ATTRS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keep only a sample of DEBUG records (including ccxt's request dumps), all other levels pass."""
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.sample_rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueue records with only their message resolved, JSON encoding happens on the listener thread."""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()  # resolve the args now, they may be mutated after the call returns
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # tracebacks are not picklable and hold frames alive
+        return record
+
+
+def configure_logging(log_file):
+    """Route all logging through a queue to a background thread that writes rotating JSON log files."""
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    # Formatting, writing and rotation run on the listener thread, off the request path
+    file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=5)  # 5 MB per file, keep 5 backups
+    file_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flush the queued records on exit
+
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler], force=True)
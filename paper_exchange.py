@@ -0,0 +1,226 @@
+import bisect
+import csv
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+PAPER_FEE_RATE = float(os.getenv("PAPER_FEE_RATE", 0.0005))  # Upbit's KRW market trading fee
+PAPER_MIN_ORDER_VALUE = 5000  # KRW
+PAPER_MAX_ORDER_VALUE = 1_000_000_000  # KRW
+REPLAY_BATCH_SIZE = 4096  # trades matched per lock acquisition
+DAY_MS = 24 * 60 * 60 * 1000
+
+logger = logging.getLogger(__name__)
+
+
+class PaperExchangeError(Exception):
+    pass
+
+
+class Book:
+    """Ticker and resting buy orders of a single market."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = []  # open buy orders sorted by price, best bid last
+        self.best_bid = float("-inf")
+        self.open = self.high = self.low = self.last = None
+        self.day_end = 0
+        self.timestamp = None
+
+    def start_day(self, timestamp, price):
+        """Start a new daily candle, Upbit's daily open is at 00:00 UTC."""
+        self.day_end = timestamp - timestamp % DAY_MS + DAY_MS
+        self.open = self.high = self.low = price
+
+
+class PaperExchange:
+    """In-memory matching engine exposing the subset of the ccxt interface used by exchange_bot.
+
+    Prices come from replayed trades instead of the exchange. A buy order fills at its limit price
+    once a trade prints at or below it, or at the last price if it is placed above the market.
+    """
+
+    def __init__(self, balances, symbols=("BTC/KRW",)):
+        self.lock = threading.RLock()
+        self.free = dict(balances)
+        self.used = {}
+        self.books = {}
+        self.orders = {}
+        self.order_ids = itertools.count(1)
+        self.order_id_prefix = f"paper-{uuid.uuid4().hex[:8]}"  # ids restart with every engine, the prefix keeps them unique
+        self.now = None  # replay clock in milliseconds
+        for symbol in symbols:
+            self.books[symbol] = Book(symbol)
+
+    # ---------------- Replay ----------------
+    def process_trades(self, trades):
+        """Match a batch of (timestamp, symbol, price) trades in time order against the resting orders."""
+        books = self.books
+        with self.lock:
+            for timestamp, symbol, price in trades:
+                book = books.get(symbol)
+                if book is None:
+                    book = books[symbol] = Book(symbol)
+                if timestamp >= book.day_end:
+                    book.start_day(timestamp, price)
+                elif price > book.high:
+                    book.high = price
+                elif price < book.low:
+                    book.low = price
+                book.last = price
+                book.timestamp = timestamp
+                if price <= book.best_bid:
+                    self.now = timestamp
+                    self._fill_bids(book, price)
+            if trades:
+                self.now = trades[-1][0]
+
+    def _fill_bids(self, book, price):
+        while book.bids and book.bids[-1]["price"] >= price:
+            order = book.bids.pop()
+            self._fill(order, order["price"])
+        book.best_bid = book.bids[-1]["price"] if book.bids else float("-inf")
+
+    def _fill(self, order, fill_price):
+        base, quote = order["symbol"].split("/")
+        locked = order["price"] * order["amount"] * (1 + PAPER_FEE_RATE)
+        spent = fill_price * order["amount"] * (1 + PAPER_FEE_RATE)
+        self.used[quote] -= locked
+        self.free[quote] = self.free.get(quote, 0) + locked - spent
+        self.free[base] = self.free.get(base, 0) + order["amount"]
+        order.update({"status": "closed", "filled": order["amount"], "remaining": 0.0, "average": fill_price, "cost": fill_price * order["amount"]})
+        logger.debug(f"Paper order {order['id']} filled at {fill_price}.", extra={"order_id": order["id"], "market": order["symbol"]})
+
+    # ---------------- ccxt Interface ----------------
+    def milliseconds(self):
+        return self.now if self.now is not None else int(time.time() * 1000)
+
+    def load_markets(self, reload=False):
+        return {
+            symbol: {
+                "symbol": symbol,
+                "limits": {"cost": {"min": PAPER_MIN_ORDER_VALUE, "max": PAPER_MAX_ORDER_VALUE}, "amount": {"min": None}},
+                "maker": PAPER_FEE_RATE,
+                "taker": PAPER_FEE_RATE,
+                "precision": {"amount": 1e-8},
+            } for symbol in self.books
+        }
+
+    def fetch_ticker(self, symbol):
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None or book.last is None:
+                raise PaperExchangeError(f"No trades replayed for {symbol} yet")
+            return {"symbol": symbol, "timestamp": book.timestamp, "open": book.open, "high": book.high, "low": book.low, "last": book.last, "close": book.last}
+
+    def fetch_tickers(self, symbols=None):
+        return {symbol: self.fetch_ticker(symbol) for symbol in (symbols or self.books)}
+
+    def fetch_order_book(self, symbol, limit=None):
+        """Order book of the resting paper orders, the replayed trades carry no asks."""
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                raise PaperExchangeError(f"Unknown market {symbol}")
+            bids = {}
+            for order in reversed(book.bids):
+                bids[order["price"]] = bids.get(order["price"], 0) + order["amount"]
+            return {"symbol": symbol, "timestamp": book.timestamp, "bids": [[price, amount] for price, amount in bids.items()][:limit], "asks": []}
+
+    def fetch_balance(self):
+        with self.lock:
+            assets = set(self.free) | set(self.used)
+            free = {asset: self.free.get(asset, 0.0) for asset in assets}
+            used = {asset: self.used.get(asset, 0.0) for asset in assets}
+            return {"free": free, "used": used, "total": {asset: free[asset] + used[asset] for asset in assets}}
+
+    def create_limit_buy_order(self, symbol, amount, price):
+        base, quote = symbol.split("/")
+        amount, price = float(amount), float(price)
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                raise PaperExchangeError(f"Unknown market {symbol}")
+            locked = price * amount * (1 + PAPER_FEE_RATE)
+            if self.free.get(quote, 0) < locked:
+                raise PaperExchangeError(f"Insufficient {quote} balance for order of {locked:,.0f} {quote}")
+            self.free[quote] -= locked
+            self.used[quote] = self.used.get(quote, 0) + locked
+            order = {
+                "id": f"{self.order_id_prefix}-{next(self.order_ids)}", "symbol": symbol, "type": "limit", "side": "buy",
+                "price": price, "amount": amount, "filled": 0.0, "remaining": amount, "status": "open",
+                "timestamp": self.milliseconds(),
+            }
+            self.orders[order["id"]] = order
+            if book.last is not None and price >= book.last:
+                self._fill(order, book.last)  # marketable order, takes the last price
+            else:
+                bisect.insort(book.bids, order, key=lambda bid: bid["price"])
+                book.best_bid = book.bids[-1]["price"]
+            return dict(order)
+
+    def cancel_order(self, id, symbol=None):
+        with self.lock:
+            order = self.orders.get(id)
+            if order is None or order["status"] != "open":
+                raise PaperExchangeError(f"Order {id} is not open")
+            book = self.books[order["symbol"]]
+            book.bids.remove(order)
+            book.best_bid = book.bids[-1]["price"] if book.bids else float("-inf")
+            quote = order["symbol"].split("/")[1]
+            locked = order["price"] * order["amount"] * (1 + PAPER_FEE_RATE)
+            self.used[quote] -= locked
+            self.free[quote] += locked
+            order["status"] = "canceled"
+            return dict(order)
+
+    def fetch_open_orders(self, symbol=None):
+        with self.lock:
+            books = [self.books[symbol]] if symbol in self.books else [] if symbol else self.books.values()
+            return [dict(order) for book in books for order in book.bids]
+
+
+# ---------------- Trade Recordings ----------------
+def read_trades(path):
+    """Read a recorded trade stream, a CSV file with timestamp (ms), symbol and price columns in time order."""
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        timestamp_index, symbol_index, price_index = header.index("timestamp"), header.index("symbol"), header.index("price")
+        for row in reader:
+            yield int(row[timestamp_index]), row[symbol_index], float(row[price_index])
+
+def replay(exchange, trades, speed=1.0):
+    """Feed trades to the exchange at `speed` times their recorded pace, or as fast as possible if speed is 0.
+
+    Returns the number of trades replayed. The clock is only read once the stream gets ahead of it,
+    so an accelerated replay costs a single comparison per trade.
+    """
+    batch = []
+    count = 0
+    started_at = time.monotonic()
+    first_timestamp = None
+    horizon = float("inf")  # latest trade timestamp that is already due
+    for trade in trades:
+        if first_timestamp is None:
+            first_timestamp = trade[0]
+            horizon = first_timestamp if speed else float("inf")
+        if trade[0] > horizon:
+            horizon = first_timestamp + (time.monotonic() - started_at) * speed * 1000
+            if trade[0] > horizon:
+                exchange.process_trades(batch)  # publish everything that is due before waiting
+                count += len(batch)
+                batch = []
+                time.sleep((trade[0] - horizon) / speed / 1000)
+                horizon = trade[0]
+        batch.append(trade)
+        if len(batch) >= REPLAY_BATCH_SIZE:
+            exchange.process_trades(batch)
+            count += len(batch)
+            batch = []
+    exchange.process_trades(batch)
+    return count + len(batch)
@@ -0,0 +1,77 @@
+import argparse
+import itertools
+import os
+import tempfile
+import time
+
+os.environ["PAPER_TRADING"] = "true"  # must be set before exchange_bot creates its exchange
+
+import exchange_bot
+import paper_exchange
+from reports import format_statistics
+
+START_PERCENTAGE_DIP = float(os.getenv("START_PERCENTAGE_DIP", 1.0))
+END_PERCENTAGE_DIP = float(os.getenv("END_PERCENTAGE_DIP", 10.0))
+PERCENTAGE_DIP_INCREMENT = float(os.getenv("PERCENTAGE_DIP_INCREMENT", 1.0))
+START_AMOUNT = int(os.getenv("START_AMOUNT", 6000))
+AMOUNT_INCREMENT = int(os.getenv("AMOUNT_INCREMENT", 1000))
+
+RELADDER_INTERVAL_MINUTES = int(os.getenv("RELADDER_INTERVAL_MINUTES", 15))
+PRICE_MOVE_THRESHOLD = float(os.getenv("PRICE_MOVE_THRESHOLD", 2.0))
+
+
+def run(path, market, speed, reladder):
+    """Replay a recorded trade stream day by day through exchange_bot's place, re-ladder and cancel endpoints."""
+    client = exchange_bot.app.test_client()
+    exchange = exchange_bot.upbit
+    ladder = {
+        "market": market,
+        "start_percentage_dip": START_PERCENTAGE_DIP,
+        "end_percentage_dip": END_PERCENTAGE_DIP,
+        "percentage_dip_increment": PERCENTAGE_DIP_INCREMENT,
+        "start_amount": START_AMOUNT,
+        "amount_increment": AMOUNT_INCREMENT,
+    }
+    trades = (trade for trade in paper_exchange.read_trades(path) if trade[1] == market)
+    interval_ms = RELADDER_INTERVAL_MINUTES * 60 * 1000 if reladder and RELADDER_INTERVAL_MINUTES > 0 else paper_exchange.DAY_MS
+
+    total_trades = 0
+    started_at = time.perf_counter()
+    for day, day_trades in itertools.groupby(trades, key=lambda trade: trade[0] // paper_exchange.DAY_MS):
+        day_trades = iter(day_trades)
+        exchange.process_trades([next(day_trades)])  # the day's first trade sets the open price
+        total_trades += 1
+        placed_orders = client.post("/place_orders", json=ladder).json.get("placed_orders", [])
+        print(f"{time.strftime('%Y-%m-%d', time.gmtime(day * paper_exchange.DAY_MS / 1000))}: placed {len(placed_orders)} {market} orders")
+
+        for _, interval_trades in itertools.groupby(day_trades, key=lambda trade: trade[0] // interval_ms):
+            total_trades += paper_exchange.replay(exchange, interval_trades, speed)
+            if reladder:
+                response = client.post("/reladder_orders", json={**ladder, "price_move_threshold": PRICE_MOVE_THRESHOLD}).json
+                if response.get("placed_orders") or response.get("cancelled_orders"):
+                    print(f"  re-laddered at {response['reference_price']:,.0f} KRW: replaced {len(response['cancelled_orders'])}, placed {len(response['placed_orders'])} orders")
+
+        response = client.post("/cancel_orders", json={"market": market}).json
+        print(f"  cancelled {len(response.get('cancelled_orders', []))} orders")
+        print(format_statistics(market, response.get("filled_orders", [])))
+
+    elapsed = time.perf_counter() - started_at
+    balances = {asset: amount for asset, amount in exchange.fetch_balance()["total"].items() if amount > 0}
+    print(f"Final balances: {balances}")
+    print(f"Replayed {total_trades:,} trades in {elapsed:.2f}s ({total_trades / elapsed:,.0f} trades/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Paper trade the dip-buy ladder on a recorded trade stream.")
+    parser.add_argument("trades", help="CSV file with timestamp (ms), symbol and price columns")
+    parser.add_argument("--market", default=exchange_bot.DEFAULT_MARKET)
+    parser.add_argument("--speed", type=float, default=0, help="1 to 1000 times the recorded pace, 0 (default) replays as fast as possible")
+    parser.add_argument("--no-reladder", dest="reladder", action="store_false", help="keep the ladder anchored to the daily open")
+    args = parser.parse_args()
+
+    # Start from an empty order tracker so earlier simulations do not leak into the report
+    exchange_bot.ORDER_TRACKER_DB = os.path.join(tempfile.mkdtemp(), "paper_order_tracker.db")
+    exchange_bot.initialize_db()
+    run(args.trades, args.market, args.speed, args.reladder)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import functools
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask import g, jsonify, request, send_from_directory
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SLOWEST_N = int(os.getenv("PROFILE_SLOWEST_N", 20))  # number of slowest requests/jobs to keep
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.001))  # sampling interval in seconds
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_FLAG = "profile"
+
+logger = logging.getLogger(__name__)
+
+# Profile every request and job while enabled through the admin endpoint
+profile_all = threading.Event()
+
+# Min-heap of (duration, sequence, entry) holding the slowest requests and jobs
+slowest_runs = []
+slowest_runs_lock = threading.Lock()
+sequence = itertools.count()
+
+
+# ---------------- Helper Functions ----------------
+def start_profiler():
+    """Start a sampling profiler for the current thread."""
+    from pyinstrument import Profiler  # imported on first use, most runs are never profiled
+    profiler = Profiler(interval=PROFILE_INTERVAL)
+    profiler.start()
+    return profiler
+
+def save_profile(profiler, name):
+    """Stop the profiler and write its samples as a speedscope file, returning the file name."""
+    from pyinstrument.renderers.speedscope import SpeedscopeRenderer
+    profiler.stop()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(sequence)}-{name.strip('/').replace('/', '_') or 'root'}.speedscope.json"
+    with open(os.path.join(PROFILE_DIR, file_name), 'w') as file:
+        file.write(profiler.output(renderer=SpeedscopeRenderer()))
+    logger.info(f"Saved profile of '{name}' to {file_name}")
+    return file_name
+
+def record_run(name, duration, profile_file=None, keep_profile=False):
+    """Record a request or job duration in the rolling log of the slowest runs.
+
+    Profiles captured only because profiling is enabled for everything are deleted once their
+    run drops out of the log. Explicitly requested profiles are always kept.
+    """
+    entry = {
+        "name": name,
+        "duration_ms": round(duration * 1000, 3),
+        "finished_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "profile_file": profile_file,
+    }
+    with slowest_runs_lock:
+        item = (duration, next(sequence), entry, keep_profile)
+        if len(slowest_runs) < PROFILE_SLOWEST_N:
+            heapq.heappush(slowest_runs, item)
+            return
+        evicted = heapq.heappushpop(slowest_runs, item)
+    _, _, evicted_entry, evicted_keep_profile = evicted
+    if evicted_entry["profile_file"] and not evicted_keep_profile:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, evicted_entry["profile_file"]))
+        except OSError as e:
+            logger.warning(f"Failed to remove profile {evicted_entry['profile_file']}: {e}")
+
+def get_slowest_runs():
+    """Retrieve the slowest runs, slowest first."""
+    with slowest_runs_lock:
+        return [entry for _, _, entry, _ in sorted(slowest_runs, key=lambda item: item[0], reverse=True)]
+
+def profile_job(func):
+    """Time a scheduled job and profile it while profiling is enabled."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = start_profiler() if profile_all.is_set() else None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            profile_file = None
+            if profiler is not None:
+                try:
+                    profile_file = save_profile(profiler, f"job_{func.__name__}")
+                except Exception as e:
+                    logger.error(f"Failed to save profile for job {func.__name__}: {e}")  # the job's outcome stands
+            record_run(f"job:{func.__name__}", duration, profile_file)
+    return wrapper
+
+
+# ---------------- Flask Integration ----------------
+def init_profiling(app):
+    """Time every request, profile the ones that ask for it and register the admin endpoints."""
+
+    @app.before_request
+    def start_request_profiling():
+        g.profile_requested = request.headers.get(PROFILE_HEADER) == "1" or request.args.get(PROFILE_QUERY_FLAG) == "1"
+        g.profiler = start_profiler() if g.profile_requested or profile_all.is_set() else None
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def stop_request_profiling(response):
+        request_start = g.pop("request_start", None)
+        if request_start is None:
+            return response
+        duration = time.perf_counter() - request_start
+        profiler = g.pop("profiler", None)
+        profile_file = None
+        if profiler is not None:
+            try:
+                profile_file = save_profile(profiler, f"{request.method}_{request.path}")
+                response.headers["X-Profile-File"] = profile_file
+            except Exception as e:
+                logger.error(f"Failed to save profile for {request.path}: {e}")
+        record_run(f"{request.method} {request.path}", duration, profile_file, keep_profile=g.pop("profile_requested", False))
+        return response
+
+    @app.route("/profiling", methods=["GET"])
+    def get_profiling():
+        return jsonify({"enabled": profile_all.is_set(), "slowest_runs": get_slowest_runs()})
+
+    @app.route("/profiling", methods=["POST"])
+    def set_profiling():
+        data = request.json or {}
+        if data.get("enabled"):
+            profile_all.set()
+        else:
+            profile_all.clear()
+        logger.info(f"Profiling of all requests and jobs {'enabled' if profile_all.is_set() else 'disabled'}.")
+        return jsonify({"enabled": profile_all.is_set()})
+
+    @app.route("/profiling/profiles/<path:file_name>", methods=["GET"])
+    def get_profile(file_name):
+        return send_from_directory(os.path.abspath(PROFILE_DIR), file_name)
+
+
+# ---------------- RPC Integration ----------------
+def profile_rpc(handlers):
+    """Time every RPC request and profile the ones that ask for it, as the Flask hooks do for REST.
+
+    A request asks for a profile with `"profile": 1` in its params, and gets the profile file name
+    back as `profile_file` in its body.
+    """
+    return {method: profile_rpc_handler(method, handler) for method, handler in handlers.items()}
+
+def profile_rpc_handler(method, handler):
+    @functools.wraps(handler)
+    def wrapper(data, *args, **kwargs):
+        profile_requested = str(data.get(PROFILE_QUERY_FLAG)) in ("1", "True")
+        profiler = start_profiler() if profile_requested or profile_all.is_set() else None
+        start = time.perf_counter()
+        profile_file = None
+        try:
+            body, status = handler(data, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is not None:
+                try:
+                    profile_file = save_profile(profiler, f"RPC_{method}")
+                except Exception as e:
+                    logger.error(f"Failed to save profile for RPC {method}: {e}")
+            record_run(f"RPC {method}", duration, profile_file, keep_profile=profile_requested)
+        if profile_file is not None:
+            body = {**body, "profile_file": profile_file}
+        return body, status
+    return wrapper
@@ -0,0 +1,28 @@
+import logging
+import os
+
+READY_FIFO = os.getenv("READY_FIFO")  # named pipe run.sh waits on, each service writes its name once it serves requests
+
+logger = logging.getLogger(__name__)
+
+
+def notify_ready(service):
+    """Tell the process that started the service that it is ready."""
+    if not READY_FIFO:
+        return
+    try:
+        fd = os.open(READY_FIFO, os.O_WRONLY | os.O_NONBLOCK)  # fails instead of blocking if nobody is waiting
+        try:
+            os.write(fd, f"{service}\n".encode())
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning(f"Failed to signal readiness on {READY_FIFO}: {e}")
+
+def serve(app, host, port, service):
+    """Serve a Flask app, signalling readiness once its port accepts connections."""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    logger.info(f"{service} listening on {host}:{port}.")
+    notify_ready(service)
+    server.serve_forever()
@@ -0,0 +1,13 @@
+def format_statistics(market, filled_orders):
+    """Format the amount bought and the weighted average price of a market's filled orders."""
+    if not filled_orders:
+        return f"No {market} orders were filled 🌚"
+    base = market.split('/')[0]
+    total_base = sum(order["amount"] for order in filled_orders)
+    total_cost = sum(order["amount"] * order["price"] for order in filled_orders)
+    weighted_avg_price = total_cost / total_base if total_base > 0 else 0
+    return (
+        f"📊 {market} Transaction Statistics:\n"
+        f"- Total {base} Purchased: {total_base:,.8f} {base}\n"
+        f"- Weighted Average Price: {weighted_avg_price:,.0f} KRW/{base}\n"
+    )
@@ -0,0 +1,253 @@
+import concurrent.futures
+import inspect
+import itertools
+import logging
+import msgpack
+import os
+import queue
+import requests
+import socket
+import threading
+
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", 30))  # seconds to wait for the next message of a call
+RPC_MAX_WORKERS = int(os.getenv("RPC_MAX_WORKERS", 8))  # requests served concurrently by the server
+RPC_MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # bytes, larger messages close the connection
+
+# Message types, every message is a msgpack array starting with its type and the request id
+REQUEST = 0  # [REQUEST, id, method, params]
+PARTIAL = 1  # [PARTIAL, id, order], one per order placed while the request runs
+RESULT = 2   # [RESULT, id, body]
+ERROR = 3    # [ERROR, id, message]
+
+# Orders are sent as arrays in this field order instead of maps repeating the keys
+ORDER_FIELDS = ("order_id", "percentage_dip", "price", "amount", "venue")
+ORDER_LIST_KEYS = ("placed_orders", "cancelled_orders", "filled_orders", "open_orders")
+
+logger = logging.getLogger(__name__)
+
+
+class RpcError(Exception):
+    """The call reached the server but failed, it must not be retried over HTTP."""
+
+
+class RpcConnectionError(RpcError):
+    """The call could not be sent, it is safe to retry over HTTP."""
+
+
+# ---------------- Encoding ----------------
+def pack_order(order):
+    return [order[field] for field in ORDER_FIELDS]
+
+def unpack_order(values):
+    return dict(zip(ORDER_FIELDS, values))
+
+def pack_body(body):
+    return {key: [pack_order(order) for order in value] if key in ORDER_LIST_KEYS else value for key, value in body.items()}
+
+def unpack_body(body):
+    return {key: [unpack_order(values) for values in value] if key in ORDER_LIST_KEYS else value for key, value in body.items()}
+
+def new_unpacker():
+    return msgpack.Unpacker(raw=False, strict_map_key=False, max_buffer_size=RPC_MAX_MESSAGE_SIZE)
+
+
+# ---------------- Server ----------------
+class RpcServer:
+    """Serve handlers returning (body, status) over persistent msgpack connections.
+
+    Requests on a connection run concurrently, so a slow ladder does not hold up a balance check.
+    Handlers taking an `on_order` callback stream each order to the caller as it is placed.
+    """
+
+    def __init__(self, handlers, max_workers=RPC_MAX_WORKERS):
+        self.handlers = handlers
+        self.streaming = {method for method, handler in handlers.items() if "on_order" in inspect.signature(handler).parameters}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="RpcWorker")
+        self.listener = None
+
+    def serve(self, host, port):
+        """Start accepting connections in a background thread."""
+        self.listener = socket.create_server((host, port))
+        threading.Thread(target=self._accept, name="RpcServer", daemon=True).start()
+        logger.info(f"RPC server listening on {host}:{port}.")
+
+    def _accept(self):
+        while True:
+            try:
+                conn, address = self.listener.accept()
+            except OSError:
+                return  # listener closed
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve_connection, args=(conn, address), name=f"RpcConnection-{address[1]}", daemon=True).start()
+
+    def _serve_connection(self, conn, address):
+        logger.debug(f"RPC client connected from {address[0]}:{address[1]}.")
+        write_lock = threading.Lock()
+        unpacker = new_unpacker()
+        try:
+            while data := conn.recv(65536):
+                unpacker.feed(data)
+                for message_type, message_id, method, params in unpacker:
+                    if message_type == REQUEST:
+                        self.executor.submit(self._handle, conn, write_lock, message_id, method, params)
+        except (OSError, ValueError, msgpack.UnpackException) as e:
+            logger.warning(f"Closing RPC connection from {address[0]}:{address[1]}: {e}")
+        finally:
+            conn.close()
+
+    def _handle(self, conn, write_lock, message_id, method, params):
+        def send(message):
+            payload = msgpack.packb(message, use_bin_type=True)
+            with write_lock:
+                conn.sendall(payload)
+
+        try:
+            handler = self.handlers.get(method)
+            if handler is None:
+                send([ERROR, message_id, f"Unknown method '{method}'"])
+                return
+            if method in self.streaming:
+                body, status = handler(params or {}, on_order=lambda order: send([PARTIAL, message_id, pack_order(order)]))
+            else:
+                body, status = handler(params or {})
+            if status >= 400:
+                send([ERROR, message_id, body.get("error", f"Request failed with status {status}")])
+            else:
+                send([RESULT, message_id, pack_body(body)])
+        except OSError as e:
+            logger.warning(f"Failed to reply to RPC request '{method}': {e}")  # the client went away
+        except Exception as e:
+            logger.error(f"Error handling RPC request '{method}': {e}")
+            try:
+                send([ERROR, message_id, "Internal error"])
+            except OSError:
+                pass
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.close()
+        self.executor.shutdown(wait=False)
+
+
+# ---------------- Client ----------------
+class RpcClient:
+    """Multiplex calls from any number of threads over a single persistent connection."""
+
+    def __init__(self, address, timeout=RPC_TIMEOUT):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()  # guards the connection and serializes writes
+        self.pending = {}
+        self.message_ids = itertools.count(1)
+
+    def _connect(self):
+        """Return the open connection, connecting first if there is none.
+
+        The connect runs outside the lock, so a slow connect does not block the calls of other threads.
+        """
+        with self.lock:
+            if self.sock is not None:
+                return self.sock
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)  # detect a peer that went away without closing
+        with self.lock:
+            if self.sock is not None:
+                sock.close()  # another call connected first
+                return self.sock
+            self.sock = sock
+        threading.Thread(target=self._read, args=(sock,), name="RpcClientReader", daemon=True).start()
+        return sock
+
+    def _close(self, sock):
+        """Close a connection, so the next call reconnects. Call with the lock held."""
+        if self.sock is sock:
+            self.sock = None
+        try:
+            sock.shutdown(socket.SHUT_RDWR)  # wakes up the reader blocked on the connection
+        except OSError:
+            pass  # already closed
+        sock.close()
+
+    def _read(self, sock):
+        unpacker = new_unpacker()
+        try:
+            while data := sock.recv(65536):
+                unpacker.feed(data)
+                for message in unpacker:
+                    call = self.pending.get(message[1])
+                    if call is not None:
+                        call[1].put(message)
+        except (OSError, ValueError, msgpack.UnpackException) as e:
+            logger.warning(f"RPC connection to {self.address[0]}:{self.address[1]} failed: {e}")
+        with self.lock:
+            self._close(sock)
+            for call_sock, replies in list(self.pending.values()):
+                if call_sock is sock:
+                    replies.put(None)  # wake up the calls still waiting on this connection
+
+    def call(self, method, params=None, on_partial=None):
+        """Call a method and return its body, passing every streamed order to `on_partial`."""
+        message_id = next(self.message_ids)
+        replies = queue.SimpleQueue()
+        payload = msgpack.packb([REQUEST, message_id, method, params or {}], use_bin_type=True)
+        sock = None
+        try:
+            try:
+                sock = self._connect()
+                with self.lock:
+                    self.pending[message_id] = (sock, replies)
+                    sock.sendall(payload)
+            except OSError as e:
+                if sock is not None:
+                    with self.lock:
+                        self._close(sock)
+                raise RpcConnectionError(f"Failed to send '{method}' to {self.address[0]}:{self.address[1]}: {e}") from e
+
+            while True:
+                try:
+                    message = replies.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self.lock:
+                        self._close(sock)  # the connection is presumed dead, the next call reconnects
+                    raise RpcError(f"Timed out waiting for '{method}'") from None
+                if message is None:
+                    raise RpcError(f"Connection lost while waiting for '{method}'")
+                message_type, _, value = message
+                if message_type == PARTIAL:
+                    if on_partial:
+                        on_partial(unpack_order(value))
+                elif message_type == RESULT:
+                    return unpack_body(value)
+                else:
+                    raise RpcError(value)
+        finally:
+            self.pending.pop(message_id, None)
+
+
+class ServiceClient:
+    """Call a service over RPC when an address is configured, falling back to JSON over HTTP.
+
+    Only calls that never reached the RPC server fall back, so an order is never placed twice.
+    """
+
+    def __init__(self, api_url, rpc_address=None, get_methods=()):
+        self.api_url = api_url
+        self.rpc = RpcClient(rpc_address) if rpc_address else None
+        self.get_methods = set(get_methods)
+
+    def call(self, method, payload=None, on_partial=None):
+        if self.rpc is not None:
+            try:
+                return self.rpc.call(method, payload, on_partial)
+            except RpcConnectionError as e:
+                logger.warning(f"{e}, falling back to HTTP.")
+        if method in self.get_methods:
+            response = requests.get(f"{self.api_url}/{method}", params=payload)
+        else:
+            response = requests.post(f"{self.api_url}/{method}", json=payload or {})
+        response.raise_for_status()  # Check for HTTP errors
+        return response.json()
@@ -3,40 +3,61 @@
 # Activate the virtual environment
 source .venv/bin/activate
 
+READY_TIMEOUT=30  # seconds a service may take to become ready
+
+# Each service writes its name to this pipe once it serves requests
+export READY_FIFO="$(mktemp -u)"
+mkfifo "$READY_FIFO"
+exec 3<>"$READY_FIFO"  # opened read-write, so neither side blocks on open
+trap 'rm -f "$READY_FIFO"' EXIT
+
+# Wait until a service signals readiness, or fail if it exits or times out first
+wait_ready() {
+    local service=$1 pid=$2 line
+    local deadline=$((SECONDS + READY_TIMEOUT))
+    while [ $SECONDS -lt $deadline ]; do
+        if read -r -t 1 -u 3 line; then
+            [ "$line" = "$service" ] && return 0
+        elif ! kill -0 "$pid" 2>/dev/null; then
+            echo "$service exited before it became ready, see $service.out"
+            return 1
+        fi
+    done
+    echo "$service did not become ready within $READY_TIMEOUT seconds"
+    return 1
+}
+
 # Run exchange_bot.py in the background
-nohup python exchange_bot.py > exchange_bot.log 2>&1 &
+nohup python exchange_bot.py > exchange_bot.out 2>&1 &  # the service writes its own JSON logs to exchange_bot.log
 EXCHANGE_BOT_PID=$!
 echo "Exchange Bot is running with PID: $EXCHANGE_BOT_PID"
 
 # Wait for the REST API from exchange_bot.py to become available
-EXCHANGE_FLASK_URL="http://localhost:5000/health"  # endpoint for health check
 echo "Waiting for Exchange Bot REST API to start..."
-while ! curl --silent --output /dev/null "$EXCHANGE_FLASK_URL"; do
-    sleep 2  # Wait for 2 seconds before checking again
-done
+wait_ready exchange_bot $EXCHANGE_BOT_PID || exit 1
 echo "Exchange Bot REST API is up and running!"
 
 # Run schedule_bot.py in the background
-nohup python schedule_bot.py > schedule_bot.log 2>&1 &
+nohup python schedule_bot.py > schedule_bot.out 2>&1 &  # the service writes its own JSON logs to schedule_bot.log
 SCHEDULE_BOT_PID=$!
 echo "Schedule Bot is running with PID: $SCHEDULE_BOT_PID"
 
 # Wait for the REST API from schedule_bot.py to become available
-SCHEDULE_FLASK_URL="http://localhost:6000/health"  # endpoint for health check
 echo "Waiting for Schedule Bot REST API to start..."
-while ! curl --silent --output /dev/null "$SCHEDULE_FLASK_URL"; do
-    sleep 2  # Wait for 2 seconds before checking again
-done
+wait_ready schedule_bot $SCHEDULE_BOT_PID || exit 1
 echo "Schedule Bot REST API is up and running!"
 
 # Run telegram_bot.py in the background
-nohup python telegram_bot.py > telegram_bot.log 2>&1 &
+nohup python telegram_bot.py > telegram_bot.out 2>&1 &  # the service writes its own JSON logs to telegram_bot.log
 TELEGRAM_BOT_PID=$!
 echo "Telegram Bot is running with PID: $TELEGRAM_BOT_PID"
 
+echo "Waiting for Telegram Bot to start..."
+wait_ready telegram_bot $TELEGRAM_BOT_PID || exit 1
+echo "Telegram Bot is up and running!"
+
 # Optional: Print all PIDs
 echo "All bots are running:"
 echo " - Exchange Bot PID: $EXCHANGE_BOT_PID"
 echo " - Schedule Bot PID: $SCHEDULE_BOT_PID"
 echo " - Telegram Bot PID: $TELEGRAM_BOT_PID"
-
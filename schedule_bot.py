@@ -1,11 +1,23 @@
+from apscheduler.events import EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify
+import functools
 import logging
-from logging.handlers import RotatingFileHandler
+from log_config import configure_logging
 import os
+from profiling import init_profiling, profile_job
+import readiness
+from reports import format_statistics
 import requests
+import rpc
+import sqlite3
+import time
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +26,11 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("CHAT_ID")
 
 EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "http://localhost:5000")  # REST API URL from exchange_bot.py
+EXCHANGE_RPC_ADDRESS = os.getenv("EXCHANGE_RPC_ADDRESS")  # host:port of exchange_bot's RPC server, unset uses the REST API
+SCHEDULER_DB = "scheduler.db"
+SCHEDULE_BOT_PORT = int(os.getenv("SCHEDULE_BOT_PORT", 6000))
+
+MARKETS = [market.strip() for market in os.getenv("MARKETS", "BTC/KRW").split(",") if market.strip()]
 
 START_PERCENTAGE_DIP = float(os.getenv("START_PERCENTAGE_DIP", 1.0))
 END_PERCENTAGE_DIP = float(os.getenv("END_PERCENTAGE_DIP", 10.0))
@@ -24,21 +41,120 @@ AMOUNT_INCREMENT = int(os.getenv("AMOUNT_INCREMENT", 1000))
 START_TIME = os.getenv("START_TIME", "00:05")
 END_TIME = os.getenv("END_TIME", "23:55")
 
+RELADDER_INTERVAL_MINUTES = int(os.getenv("RELADDER_INTERVAL_MINUTES", 15))  # 0 disables intraday re-laddering
+PRICE_MOVE_THRESHOLD = float(os.getenv("PRICE_MOVE_THRESHOLD", 2.0))  # percentage move from the ladder's reference price that triggers a re-ladder
+
+MISFIRE_GRACE_TIME = int(os.getenv("MISFIRE_GRACE_TIME", 3600))  # seconds a missed job may still run late, e.g. after a restart
+COALESCE_MISSED_RUNS = os.getenv("COALESCE_MISSED_RUNS", "true").lower() == "true"  # run a job once instead of once per missed run
+
 # Configure logging
-log_file = "schedule_bot.log"
-log_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=5)
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG, 
-    handlers=[log_handler]
-)
+configure_logging("schedule_bot.log")
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
-scheduler = BackgroundScheduler(timezone="UTC")
+init_profiling(app)
+scheduler = BackgroundScheduler(
+    jobstores={"default": SQLAlchemyJobStore(url=f"sqlite:///{SCHEDULER_DB}")},  # jobs survive restarts
+    job_defaults={"misfire_grace_time": MISFIRE_GRACE_TIME, "coalesce": COALESCE_MISSED_RUNS, "max_instances": 1},
+    timezone="UTC",
+)
+# The jobs of a market run one at a time in the order they came due, so a cancel and a place caught up
+# together after a downtime cannot overtake each other. Jobs of different markets run in parallel.
+for market in MARKETS:
+    scheduler.add_executor(ThreadPoolExecutor(1), f"market:{market}")
+exchange = rpc.ServiceClient(EXCHANGE_API_URL, EXCHANGE_RPC_ADDRESS, get_methods=("check_balances", "check_orders"))
+
+# ---------------- Database Functions ----------------
+def initialize_db():
+    """Initialize the job run history table next to the job store."""
+    conn = sqlite3.connect(SCHEDULER_DB)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            started_at TIMESTAMP,
+            duration_ms REAL,
+            status TEXT,
+            error TEXT
+        )
+    ''')
+    c.execute('''CREATE INDEX IF NOT EXISTS job_runs_job_id ON job_runs (job_id, started_at)''')
+    conn.commit()
+    conn.close()
+
+def insert_job_run(job_id, started_at, duration_ms, status, error=None):
+    """Insert a job run into the history."""
+    conn = sqlite3.connect(SCHEDULER_DB)
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO job_runs (job_id, started_at, duration_ms, status, error)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (job_id, started_at, duration_ms, status, error))
+    conn.commit()
+    conn.close()
+
+def get_job_runs(job_id=None, limit=100):
+    """Retrieve the most recent job runs, optionally of a single job."""
+    conn = sqlite3.connect(SCHEDULER_DB)
+    c = conn.cursor()
+    if job_id:
+        c.execute('''SELECT job_id, started_at, duration_ms, status, error FROM job_runs WHERE job_id = ? ORDER BY id DESC LIMIT ?''', (job_id, limit))
+    else:
+        c.execute('''SELECT job_id, started_at, duration_ms, status, error FROM job_runs ORDER BY id DESC LIMIT ?''', (limit,))
+    rows = c.fetchall()
+    conn.close()
+    keys = ["job_id", "started_at", "duration_ms", "status", "error"]
+    return [dict(zip(keys, row)) for row in rows]
+
+def get_job_run_stats():
+    """Retrieve run counts and durations per job."""
+    conn = sqlite3.connect(SCHEDULER_DB)
+    c = conn.cursor()
+    c.execute('''
+        SELECT job_id, COUNT(*), SUM(status = 'error'), SUM(status = 'missed'), AVG(duration_ms), MAX(duration_ms), MAX(started_at)
+        FROM job_runs GROUP BY job_id
+    ''')
+    rows = c.fetchall()
+    conn.close()
+    keys = ["job_id", "runs", "errors", "missed", "avg_duration_ms", "max_duration_ms", "last_started_at"]
+    return [dict(zip(keys, row)) for row in rows]
 
 # ---------------- Helper Functions ----------------
+def get_job_id(func, market):
+    return f"{func.__name__}_job:{market}"
+
+def track_job_run(func):
+    """Record the start time, duration and outcome of every run of a market job.
+
+    A run fails when the job raises, the jobs re-raise their errors after notifying the chat.
+    """
+    @functools.wraps(func)
+    def wrapper(market):
+        started_at = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
+        status, error = "success", None
+        try:
+            return func(market)
+        except Exception as e:
+            status, error = "error", str(e)
+            raise
+        finally:
+            try:
+                insert_job_run(get_job_id(func, market), started_at, (time.perf_counter() - start) * 1000, status, error)
+            except Exception as e:
+                logger.error(f"Error recording run of {func.__name__} for {market}: {e}")
+    return wrapper
+
+def record_missed_job(event):
+    """Record job runs that were skipped because they missed their misfire grace time."""
+    try:
+        insert_job_run(event.job_id, event.scheduled_run_time.isoformat(), None, "missed")
+        logger.warning(f"Job {event.job_id} missed its run at {event.scheduled_run_time}")
+    except Exception as e:
+        logger.error(f"Error recording missed run of {event.job_id}: {e}")
+
 def send_message(text):
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {
@@ -52,67 +168,117 @@ def send_message(text):
         logger.error(f"Error sending a message: {e}")
         raise  # Re-raise the exception after logging
 
-def place_orders():
+@track_job_run
+@profile_job
+def place_orders(market):
     try:
         payload = {
+            "market": market,
             "start_percentage_dip": START_PERCENTAGE_DIP,
             "end_percentage_dip": END_PERCENTAGE_DIP,
             "percentage_dip_increment": PERCENTAGE_DIP_INCREMENT,
             "start_amount": START_AMOUNT,
             "amount_increment": AMOUNT_INCREMENT,
         }
-        response = requests.post(f"{EXCHANGE_API_URL}/place_orders", json=payload)
-        response.raise_for_status()  # Check for HTTP errors
+        response = exchange.call("place_orders", payload)
 
-        placed_orders = response.json().get('placed_orders', [])
+        placed_orders = response.get('placed_orders', [])
         if placed_orders:
-            orders_message = f"Placed {len(placed_orders)} orders:\n" + "\n".join(
-                [f"- {placed_order['percentage_dip']:.2f}% Dip: {placed_order['amount']:,.8f} BTC @ {placed_order['price']:,.0f} KRW" for placed_order in placed_orders]
+            orders_message = f"Placed {len(placed_orders)} {market} orders:\n" + "\n".join(
+                [f"- {placed_order['percentage_dip']:.2f}% Dip: {placed_order['amount']:,.8f} {market.split('/')[0]} @ {placed_order['price']:,.0f} KRW" for placed_order in placed_orders]
             )
             send_message(orders_message)
         else:
-            send_message("No orders were placed 🌚")
+            send_message(f"No {market} orders were placed 🌚")
     except Exception as e:
-        logger.error(f"Error placing orders: {e}")
-        send_message("An error occurred while placing orders. Please try again later 🌝")
+        logger.error(f"Error placing {market} orders: {e}")
+        send_message(f"An error occurred while placing {market} orders. Please try again later 🌝")
+        raise  # recorded as a failed run
 
-def cancel_orders():
+@track_job_run
+@profile_job
+def cancel_orders(market):
     try:
-        response = requests.post(f"{EXCHANGE_API_URL}/cancel_orders")
-        response.raise_for_status()  # Check for HTTP errors
+        response = exchange.call("cancel_orders", {"market": market})
 
-        cancelled_orders = response.json().get('cancelled_orders', [])
+        cancelled_orders = response.get('cancelled_orders', [])
         if cancelled_orders:
-            orders_message = f"Cancelled {len(cancelled_orders)} orders:\n" + "\n".join(
-                [f"- {cancelled_order['percentage_dip']:.2f}% Dip: {cancelled_order['amount']:,.8f} BTC @ {cancelled_order['price']:,.0f} KRW" for cancelled_order in cancelled_orders]
+            orders_message = f"Cancelled {len(cancelled_orders)} {market} orders:\n" + "\n".join(
+                [f"- {cancelled_order['percentage_dip']:.2f}% Dip: {cancelled_order['amount']:,.8f} {market.split('/')[0]} @ {cancelled_order['price']:,.0f} KRW" for cancelled_order in cancelled_orders]
             )
             send_message(orders_message)
         else:
-            orders_message = "No orders were cancelled 🌚"
-
-        filled_orders = response.json().get('filled_orders', [])
-        if filled_orders:
-            total_btc = sum(order["amount"] for order in filled_orders)
-            total_cost = sum(order["amount"] * order["price"] for order in filled_orders)
-            weighted_avg_price = total_cost / total_btc if total_btc > 0 else 0
-
-            stats_message = (
-                f"📊 Transaction Statistics:\n"
-                f"- Total BTC Purchased: {total_btc:,.8f} BTC\n"
-                f"- Weighted Average Price: {weighted_avg_price:,.0f} KRW/BTC\n"
+            orders_message = f"No {market} orders were cancelled 🌚"
+
+        send_message(format_statistics(market, response.get('filled_orders', [])))
+    except Exception as e:
+        logger.error(f"Error cancelling {market} orders: {e}")
+        send_message(f"An error occurred while cancelling {market} orders. Please try again later 🌝")
+        raise  # recorded as a failed run
+
+    failed_venues = response.get('failed_venues', [])
+    if failed_venues:
+        send_message(f"{market} orders on {', '.join(failed_venues)} could not be checked and may still be open 🌝")
+        raise RuntimeError(f"Failed to cancel {market} orders on {', '.join(failed_venues)}")  # recorded as a failed run
+
+@track_job_run
+@profile_job
+def reladder_orders(market):
+    try:
+        payload = {
+            "market": market,
+            "start_percentage_dip": START_PERCENTAGE_DIP,
+            "end_percentage_dip": END_PERCENTAGE_DIP,
+            "percentage_dip_increment": PERCENTAGE_DIP_INCREMENT,
+            "start_amount": START_AMOUNT,
+            "amount_increment": AMOUNT_INCREMENT,
+            "price_move_threshold": PRICE_MOVE_THRESHOLD,
+        }
+        response = exchange.call("reladder_orders", payload)
+
+        cancelled_orders = response.get('cancelled_orders', [])
+        placed_orders = response.get('placed_orders', [])
+        if cancelled_orders or placed_orders:
+            orders_message = f"Re-laddered {market} at {response['reference_price']:,.0f} KRW, replaced {len(cancelled_orders)} and placed {len(placed_orders)} orders:\n" + "\n".join(
+                [f"- {placed_order['percentage_dip']:.2f}% Dip: {placed_order['amount']:,.8f} {market.split('/')[0]} @ {placed_order['price']:,.0f} KRW" for placed_order in placed_orders]
             )
+            send_message(orders_message)
         else:
-            stats_message = "No orders were filled 🌚"
-        send_message(stats_message)
+            logger.info(f"Re-ladder of {market} skipped: {response.get('status')}")
     except Exception as e:
-        logger.error(f"Error cancelling orders: {e}")
-        send_message("An error occurred while cancelling orders. Please try again later 🌝")
+        logger.error(f"Error re-laddering {market} orders: {e}")
+        raise  # recorded as a failed run
+
+def schedule_job(func, market, trigger):
+    """Schedule a market job on the market's executor, replacing a persisted one unless it is unchanged.
+
+    An unchanged job keeps its next run time, so a run missed while the bot was down is still caught up.
+    """
+    job_id = get_job_id(func, market)
+    executor = f"market:{market}"
+    job = scheduler.get_job(job_id)
+    if job is None or str(job.trigger) != str(trigger) or job.executor != executor:
+        scheduler.add_job(func, trigger, args=[market], id=job_id, executor=executor, replace_existing=True)
+    return job_id
 
 def schedule_daily_jobs():
-    """Schedules the place and cancel jobs based on START_TIME and END_TIME."""
-    scheduler.add_job(place_orders, 'cron', hour=START_TIME.split(":")[0], minute=START_TIME.split(":")[1], id="place_orders_job")
-    scheduler.add_job(cancel_orders, 'cron', hour=END_TIME.split(":")[0], minute=END_TIME.split(":")[1], id="cancel_orders_job")
-    logger.info(f"Scheduled jobs: Place Orders at {START_TIME}, Cancel Orders at {END_TIME}")
+    """Schedules the place and cancel jobs of every market based on START_TIME and END_TIME.
+
+    Jobs of markets or re-ladders that are no longer configured are removed.
+    """
+    job_ids = set()
+    for market in MARKETS:
+        job_ids.add(schedule_job(place_orders, market, CronTrigger(hour=START_TIME.split(":")[0], minute=START_TIME.split(":")[1], timezone=scheduler.timezone)))
+        job_ids.add(schedule_job(cancel_orders, market, CronTrigger(hour=END_TIME.split(":")[0], minute=END_TIME.split(":")[1], timezone=scheduler.timezone)))
+        if RELADDER_INTERVAL_MINUTES > 0:
+            job_ids.add(schedule_job(reladder_orders, market, IntervalTrigger(minutes=RELADDER_INTERVAL_MINUTES, timezone=scheduler.timezone)))
+    for job in scheduler.get_jobs():
+        if job.id not in job_ids:
+            scheduler.remove_job(job.id)
+            logger.info(f"Removed job {job.id}, it is no longer configured.")
+    logger.info(f"Scheduled jobs for {', '.join(MARKETS)}: Place Orders at {START_TIME}, Cancel Orders at {END_TIME}")
+    if RELADDER_INTERVAL_MINUTES > 0:
+        logger.info(f"Scheduled jobs: Re-ladder Orders every {RELADDER_INTERVAL_MINUTES} minutes on a {PRICE_MOVE_THRESHOLD}% price move")
 
 # ---------------- REST API Endpoints ----------------
 @app.route("/health", methods=["GET"])
@@ -123,10 +289,11 @@ def health_check():
         logger.error(f"Health check failed: {e}")
         return jsonify({"status": "ERROR", "message": "Health check failed."}), 500
 
+# The scheduler itself always runs so persisted jobs resume after a restart, starting and
+# stopping only adds and removes the jobs
 @app.route("/start_scheduler", methods=["POST"])
 def start_scheduler():
-    if not scheduler.running:
-        scheduler.start()
+    if not scheduler.get_jobs():
         schedule_daily_jobs()
         logger.info("Scheduler started and jobs scheduled.")
         return jsonify({"status": "Scheduler started and jobs scheduled."}), 200
@@ -135,15 +302,44 @@ def start_scheduler():
 
 @app.route("/stop_scheduler", methods=["POST"])
 def stop_scheduler():
-    if scheduler.running:
-        scheduler.shutdown()
+    if scheduler.get_jobs():
+        scheduler.remove_all_jobs()
         logger.info("Scheduler stopped.")
         return jsonify({"status": "Scheduler stopped."}), 200
     logger.warning("Scheduler is not running.")
     return jsonify({"status": "Scheduler is not running."}), 200
 
+@app.route("/jobs", methods=["GET"])
+def get_jobs():
+    try:
+        jobs = [{
+            "job_id": job.id,
+            "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
+            "trigger": str(job.trigger)
+        } for job in scheduler.get_jobs()]
+        return jsonify({"jobs": jobs})
+    except Exception as e:
+        logger.error(f"Error fetching jobs: {e}")
+        return jsonify({"error": "Failed to fetch jobs"}), 500
+
+@app.route("/job_runs", methods=["GET"])
+def job_runs():
+    try:
+        job_id = request.args.get("job_id")
+        limit = request.args.get("limit", 100, type=int)
+        return jsonify({"job_runs": get_job_runs(job_id, limit), "stats": get_job_run_stats()})
+    except Exception as e:
+        logger.error(f"Error fetching job runs: {e}")
+        return jsonify({"error": "Failed to fetch job runs"}), 500
+
 
 # ---------------- Main Program ----------------
 if __name__ == "__main__":
-    logger.info("Schedule bot started with REST API.")
-    app.run(host="0.0.0.0", port=6000, debug=True)
+    initialize_db()
+    scheduler.add_listener(record_missed_job, EVENT_JOB_MISSED)
+    scheduler.start(paused=True)  # no job runs until the persisted jobs match the configuration
+    if scheduler.get_jobs():
+        schedule_daily_jobs()  # START_TIME, END_TIME, MARKETS or the re-ladder interval may have changed since the jobs were saved
+    scheduler.resume()  # runs the persisted jobs, catching up on runs missed within MISFIRE_GRACE_TIME
+    logger.info(f"Schedule bot started with REST API and {len(scheduler.get_jobs())} persisted jobs.")
+    readiness.serve(app, "0.0.0.0", SCHEDULE_BOT_PORT, "schedule_bot")  # a single process, a reloader would start a second scheduler on the same job store
@@ -0,0 +1,87 @@
+import argparse
+import os
+import select
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICES = ("exchange_bot", "schedule_bot")  # telegram_bot needs a bot token and Telegram to start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def import_times(service, work_dir, top=5):
+    """Import a service with -X importtime and return its total and its slowest top-level imports in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {service}"],
+        cwd=work_dir, env={**os.environ, "PYTHONPATH": REPO_DIR}, capture_output=True, text=True
+    )
+    total, imports = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2  # nested imports are indented by two spaces per level
+        if level == 0 and name.strip() == service:
+            total = int(cumulative) / 1000
+        elif level == 1:
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return total, sorted(imports, reverse=True)[:top]
+
+def time_to_ready(service, work_dir, timeout=30):
+    """Start a service and return the milliseconds until it signals readiness."""
+    fifo = os.path.join(work_dir, f"{service}.ready")
+    if not os.path.exists(fifo):
+        os.mkfifo(fifo)
+    reader = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+    env = {
+        **os.environ,
+        "READY_FIFO": fifo,
+        "EXCHANGE_BOT_PORT": str(free_port()),
+        "SCHEDULE_BOT_PORT": str(free_port()),
+        "BALANCE_SAMPLE_INTERVAL": "0",
+    }
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, f"{service}.py")], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if select.select([reader], [], [], 0.1)[0] and os.read(reader, 1024).decode().strip() == service:
+                return (time.perf_counter() - start) * 1000
+            if process.poll() is not None:
+                raise RuntimeError(f"{service} exited with status {process.returncode} before it became ready")
+        raise RuntimeError(f"{service} did not become ready within {timeout} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+        os.close(reader)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time and time to readiness of the services.")
+    parser.add_argument("services", nargs="*", default=SERVICES)
+    parser.add_argument("--runs", type=int, default=5, help="starts per service, all but the first reuse the on-disk caches")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="fail if a service's median restart takes longer")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()  # databases, logs and caches of the runs
+    over_budget = []
+    for service in args.services:
+        total, slowest = import_times(service, work_dir)
+        print(f"{service}: import {total:.0f} ms, slowest imports: {', '.join(f'{name} {ms:.0f} ms' for ms, name in slowest)}")
+        durations = [time_to_ready(service, work_dir) for _ in range(args.runs)]
+        restart_ms = statistics.median(durations[1:] or durations)
+        print(f"{service}: first start {durations[0]:.0f} ms, median restart {restart_ms:.0f} ms")
+        if restart_ms > args.budget_ms:
+            over_budget.append(service)
+
+    if over_budget:
+        sys.exit(f"Over the {args.budget_ms:.0f} ms startup budget: {', '.join(over_budget)}")
+
+if __name__ == "__main__":
+    main()
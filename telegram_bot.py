@@ -1,16 +1,22 @@
+import asyncio
 from dotenv import load_dotenv
 import logging
-from logging.handlers import RotatingFileHandler
+from log_config import configure_logging
 import os
+import readiness
 import requests
+import rpc
 from telegram import Update, BotCommand
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes
+import time
 
 # Load environment variables
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "http://localhost:5000")  # REST API URL from exchange_bot.py
+EXCHANGE_RPC_ADDRESS = os.getenv("EXCHANGE_RPC_ADDRESS")  # host:port of exchange_bot's RPC server, unset uses the REST API
 SCHEDULE_API_URL = os.getenv("SCHEDULE_API_URL", "http://localhost:6000")  # REST API URL from schedule_bot.py
 
 START_PERCENTAGE_DIP = float(os.getenv("START_PERCENTAGE_DIP", 1.0))
@@ -19,16 +25,34 @@ PERCENTAGE_DIP_INCREMENT = float(os.getenv("PERCENTAGE_DIP_INCREMENT", 1.0))
 START_AMOUNT = int(os.getenv("START_AMOUNT", 6000))
 AMOUNT_INCREMENT = int(os.getenv("AMOUNT_INCREMENT", 1000))
 
+PROGRESS_EDIT_INTERVAL = 1.0  # seconds between edits of a progress message, Telegram rate-limits message edits
+
 # Configure logging
-log_file = "telegram_bot.log"
-log_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=5)
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG, 
-    handlers=[log_handler]
-)
+configure_logging("telegram_bot.log")
 logger = logging.getLogger(__name__)
 
+exchange = rpc.ServiceClient(EXCHANGE_API_URL, EXCHANGE_RPC_ADDRESS, get_methods=("check_balances", "check_orders"))
+
+# ---------------- Helper Functions ----------------
+async def send_final_message(update, progress_message, text, attempts=3):
+    """Replace a progress message with the final result, waiting out Telegram's flood limit.
+
+    Falls back to a new message if the progress message cannot be edited, so the result always arrives.
+    """
+    for _ in range(attempts):
+        try:
+            await progress_message.edit_text(text)
+            return
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.warning(f"Error editing the progress message: {e}")
+            break
+    try:
+        await update.message.reply_text(text)
+    except Exception as e:
+        logger.error(f"Error sending the final message: {e}")
+
 # ---------------- Telegram Command Handlers ----------------
 # Command handler: /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -51,10 +75,9 @@ Commands:
 # Command handler: /check_balances
 async def check_balances(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        response = requests.get(f"{EXCHANGE_API_URL}/check_balances")
-        response.raise_for_status()  # Check for HTTP errors
+        response = exchange.call("check_balances")
 
-        non_zero_balances = response.json().get('non_zero_balances', {})
+        non_zero_balances = response.get('non_zero_balances', {})
         if non_zero_balances:
             balance_message = "Current balances:\n" + "\n".join(
                 [f"{asset}: {amount:,.8g}" for asset, amount in non_zero_balances.items()]
@@ -62,7 +85,11 @@ async def check_balances(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text(balance_message)
         else:
             await update.message.reply_text("No balances 🌚")
-        
+
+        failed_venues = response.get('failed_venues', [])
+        if failed_venues:
+            await update.message.reply_text(f"Balances from {', '.join(failed_venues)} could not be fetched and are not included 🌝")
+
     except Exception as e:
         logger.error(f"Error fetching balances: {e}")
         await update.message.reply_text("An error occurred while fetching orders. Please try again later 🌝")
@@ -77,17 +104,34 @@ async def place_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "start_amount": START_AMOUNT,
             "amount_increment": AMOUNT_INCREMENT,
         }
-        response = requests.post(f"{EXCHANGE_API_URL}/place_orders", json=payload)
-        response.raise_for_status()  # Check for HTTP errors
+        progress_message = await update.message.reply_text("Placing orders...")
+        loop = asyncio.get_running_loop()
+        streamed_orders = []
+        edits = []
+        last_edit_at = [0.0]
+
+        def on_order(order):
+            # Called from the worker thread for every rung the exchange bot places over RPC
+            streamed_orders.append(order)
+            if time.monotonic() - last_edit_at[0] < PROGRESS_EDIT_INTERVAL:
+                return  # shown by the next edit or the final message
+            last_edit_at[0] = time.monotonic()
+            orders_message = f"Placing orders, {len(streamed_orders)} placed so far:\n" + "\n".join(
+                [f"- {placed_order['percentage_dip']:.2f}% Dip: {placed_order['amount']:,.8f} BTC @ {placed_order['price']:,.0f} KRW" for placed_order in streamed_orders]
+            )
+            edits.append(asyncio.run_coroutine_threadsafe(progress_message.edit_text(orders_message), loop))
 
-        placed_orders = response.json().get('placed_orders', [])
+        response = await asyncio.to_thread(exchange.call, "place_orders", payload, on_order)
+        await asyncio.gather(*[asyncio.wrap_future(edit) for edit in edits], return_exceptions=True)  # the final message must come last
+
+        placed_orders = response.get('placed_orders', [])
         if placed_orders:
             orders_message = f"Placed {len(placed_orders)} orders:\n" + "\n".join(
                 [f"- {placed_order['percentage_dip']:.2f}% Dip: {placed_order['amount']:,.8f} BTC @ {placed_order['price']:,.0f} KRW" for placed_order in placed_orders]
             )
-            await update.message.reply_text(orders_message)
         else:
-            await update.message.reply_text("No orders were placed 🌚")
+            orders_message = "No orders were placed 🌚"
+        await send_final_message(update, progress_message, orders_message)  # the orders are placed, a flood limit must not turn this into an error
         
     except Exception as e:
         logger.error(f"Error placing orders: {e}")
@@ -96,10 +140,9 @@ async def place_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 # Command handler: /cancel_orders
 async def cancel_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        response = requests.post(f"{EXCHANGE_API_URL}/cancel_orders")
-        response.raise_for_status()  # Check for HTTP errors
+        response = exchange.call("cancel_orders")
 
-        cancelled_orders = response.json().get('cancelled_orders', [])
+        cancelled_orders = response.get('cancelled_orders', [])
         if cancelled_orders:
             orders_message = f"Cancelled {len(cancelled_orders)} orders:\n" + "\n".join(
                 [f"- {cancelled_order['percentage_dip']:.2f}% Dip: {cancelled_order['amount']:,.8f} BTC @ {cancelled_order['price']:,.0f} KRW" for cancelled_order in cancelled_orders]
@@ -108,7 +151,7 @@ async def cancel_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         else:
             orders_message = "No orders were cancelled 🌚"
 
-        filled_orders = response.json().get('filled_orders', [])
+        filled_orders = response.get('filled_orders', [])
         if filled_orders:
             total_btc = sum(order["amount"] for order in filled_orders)
             total_cost = sum(order["amount"] * order["price"] for order in filled_orders)
@@ -122,6 +165,10 @@ async def cancel_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         else:
             stats_message = "No orders were filled 🌚"
         await update.message.reply_text(stats_message)
+
+        failed_venues = response.get('failed_venues', [])
+        if failed_venues:
+            await update.message.reply_text(f"Orders on {', '.join(failed_venues)} could not be checked and may still be open 🌝")
     except Exception as e:
         logger.error(f"Error cancelling orders: {e}")
         await update.message.reply_text("An error occurred while cancelling orders. Please try again later 🌝")
@@ -129,10 +176,9 @@ async def cancel_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 # Command handler: /check_orders
 async def check_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        response = requests.get(f"{EXCHANGE_API_URL}/check_orders")
-        response.raise_for_status()  # Check for HTTP errors
+        response = exchange.call("check_orders")
 
-        open_orders = response.json().get('open_orders', [])
+        open_orders = response.get('open_orders', [])
 
         if open_orders:
             orders_message = f"Current orders:\n" + "\n".join(
@@ -141,6 +187,10 @@ async def check_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await update.message.reply_text(orders_message)
         else:
             await update.message.reply_text("No open orders 🌚")
+
+        failed_venues = response.get('failed_venues', [])
+        if failed_venues:
+            await update.message.reply_text(f"Orders on {', '.join(failed_venues)} could not be checked and are not listed 🌝")
     except Exception as e:
         logger.error(f"Error fetching orders: {e}")
         await update.message.reply_text("An error occurred while fetching orders. Please try again later 🌝")
@@ -177,6 +227,7 @@ async def post_init(application: Application) -> None:
         BotCommand("start_scheduler", "Start daily order scheduler"),
         BotCommand("stop_scheduler", "Stop daily order scheduler"),
     ])
+    readiness.notify_ready("telegram_bot")
 
 # ---------------- Main Application ----------------
 def main():
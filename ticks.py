@@ -0,0 +1,11 @@
+# Upbit KRW market tick sizes as (minimum price, tick size): each tick size applies from its price up to the next level
+UPBIT_KRW_TICK_SIZES = (
+    (0, 1e-8), (0.0001, 1e-7), (0.001, 1e-6), (0.01, 1e-5), (0.1, 1e-4), (1, 1e-3), (10, 0.01),
+    (100, 0.1), (1_000, 1), (10_000, 10), (100_000, 50), (500_000, 100), (1_000_000, 500), (2_000_000, 1_000),
+)
+
+
+def round_upbit_price(price):
+    """Round a KRW price to the nearest tick of Upbit's tick-size table."""
+    tick_size = next(tick_size for min_price, tick_size in reversed(UPBIT_KRW_TICK_SIZES) if price >= min_price)
+    return round(round(price / tick_size) * tick_size, 8)  # the second round drops float noise from small ticks
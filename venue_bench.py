@@ -0,0 +1,110 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ["PAPER_TRADING"] = "true"  # the stand-in venues replace every real exchange
+os.environ["BALANCE_SAMPLE_INTERVAL"] = "0"
+
+import exchange_bot
+import paper_exchange
+import venues
+
+LADDER = {
+    "start_percentage_dip": 1.0,
+    "end_percentage_dip": 10.0,
+    "percentage_dip_increment": 1.0,
+    "start_amount": 6000,
+    "amount_increment": 1000,
+}
+
+
+class StandInVenue(paper_exchange.PaperExchange):
+    """Paper exchange answering after a fixed delay, standing in for a remote venue."""
+
+    def __init__(self, latency, fee_rate, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.fee_rate = fee_rate
+
+    def load_markets(self, reload=False):
+        markets = super().load_markets(reload)
+        for market in markets.values():
+            market["maker"] = market["taker"] = self.fee_rate
+        return markets
+
+    def fetch_ticker(self, symbol):
+        time.sleep(self.latency)
+        return super().fetch_ticker(symbol)
+
+    def fetch_order_book(self, symbol, limit=None):
+        time.sleep(self.latency)
+        return super().fetch_order_book(symbol, limit)
+
+    def fetch_open_orders(self, symbol=None):
+        time.sleep(self.latency)
+        return super().fetch_open_orders(symbol)
+
+    def create_limit_buy_order(self, symbol, amount, price):
+        time.sleep(self.latency)
+        return super().create_limit_buy_order(symbol, amount, price)
+
+    def cancel_order(self, id, symbol=None):
+        time.sleep(self.latency)
+        return super().cancel_order(id, symbol)
+
+
+def timed(fn, rounds):
+    """Median wall time of fn in milliseconds."""
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure quoting and routing across local stand-in venues.")
+    parser.add_argument("--venues", type=int, default=4, help="number of stand-in venues, at least 3")
+    parser.add_argument("--latency-ms", type=float, default=30, help="delay of every stand-in venue call")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--market", default=exchange_bot.DEFAULT_MARKET)
+    args = parser.parse_args()
+    if args.venues < 3:
+        parser.error("--venues must be at least 3")
+
+    # Venue i trades i * 0.2% below the primary one. The last venue is the lowest before fees, but its
+    # 0.4% higher fee makes the one before it the cheapest after fees, so neither the primary venue
+    # (which wins ties) nor a routing that ignores fees picks the right venue
+    clients = {}
+    for i in range(args.venues):
+        fee_rate = 0.0045 if i == args.venues - 1 else 0.0005
+        client = StandInVenue(args.latency_ms / 1000, fee_rate, balances={"KRW": 10_000_000}, symbols=(args.market,))
+        client.process_trades([(int(time.time() * 1000), args.market, 100_000_000 * (1 - i * 0.002))])
+        clients["upbit" if i == 0 else f"venue{i}"] = client
+    cheapest_venue = f"venue{args.venues - 2}"
+    router = venues.VenueRouter(clients)
+    exchange_bot.router = router
+    exchange_bot.ORDER_TRACKER_DB = os.path.join(tempfile.mkdtemp(), "bench_order_tracker.db")
+    exchange_bot.initialize_db()
+
+    sequential_ms = timed(lambda: [client.fetch_ticker(args.market) for client in clients.values()], args.rounds)
+    concurrent_ms = timed(lambda: router.fetch_tickers(args.market), args.rounds)
+    quotes_ms = timed(lambda: exchange_bot.fetch_venue_quotes({"market": args.market}), args.rounds)
+    print(f"Quoting {args.venues} venues at {args.latency_ms:.0f} ms each: sequential {sequential_ms:.1f} ms, concurrent {concurrent_ms:.1f} ms, ticker and order book {quotes_ms:.1f} ms")
+
+    body, status = exchange_bot.place_ladder({"market": args.market, **LADDER})
+    routed_venues = {order["venue"] for order in body.get("placed_orders", [])}
+    print(f"Placed {len(body.get('placed_orders', []))} rungs on {', '.join(sorted(routed_venues)) or 'no venue'}")
+    body, status = exchange_bot.cancel_ladder({"market": args.market})
+    print(f"Cancelled {len(body.get('cancelled_orders', []))} rungs")
+
+    if routed_venues != {cheapest_venue}:
+        sys.exit(f"Rungs were not routed to {cheapest_venue}, the cheapest venue after fees.")
+    if concurrent_ms > args.latency_ms * 2:
+        sys.exit(f"Concurrent quoting took {concurrent_ms:.1f} ms, more than twice the venue latency.")
+
+if __name__ == "__main__":
+    main()
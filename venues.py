@@ -0,0 +1,176 @@
+import concurrent.futures
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+DEFAULT_FEE_RATE = float(os.getenv("DEFAULT_FEE_RATE", 0.0005))  # used when neither the env nor the market metadata has a fee
+MARKETS_CACHE_DIR = os.getenv("MARKETS_CACHE_DIR", "markets_cache")  # markets and currencies of each venue, empty disables the cache
+
+logger = logging.getLogger(__name__)
+
+
+def load_exchange_class(venue):
+    """Import a single ccxt exchange class.
+
+    ccxt's __init__ imports every exchange it supports, which is most of its import time. The
+    package is registered without running it, so only the base classes and the one exchange are
+    imported. Falls back to the full package if that does not work with the installed ccxt.
+    The bare package gets the base exchange class and the error classes, so `ccxt.NetworkError`
+    and the like work as with the full package.
+    """
+    if "ccxt" not in sys.modules:
+        spec = importlib.util.find_spec("ccxt")
+        package = types.ModuleType("ccxt")
+        package.__spec__, package.__file__, package.__path__ = spec, spec.origin, list(spec.submodule_search_locations)
+        sys.modules["ccxt"] = package
+    try:
+        exchange_class = getattr(importlib.import_module(f"ccxt.{venue}"), venue)
+    except (ImportError, AttributeError) as e:
+        logger.warning(f"Importing the full ccxt package for {venue}: {e}")
+        if not hasattr(sys.modules["ccxt"], "Exchange"):
+            del sys.modules["ccxt"]  # drop the bare package so __init__ runs
+        return getattr(importlib.import_module("ccxt"), venue)
+    package = sys.modules["ccxt"]
+    if not hasattr(package, "Exchange"):  # already imported by the exchange module, copying them is cheap
+        errors = importlib.import_module("ccxt.base.errors")
+        package.__dict__.update({name: value for name, value in vars(errors).items() if not name.startswith("_")})
+        package.Exchange = importlib.import_module("ccxt.base.exchange").Exchange
+    return exchange_class
+
+def create_client(venue, api_key=None, secret=None):
+    """Create a ccxt client for a venue, by default with its keys from <VENUE>_API_KEY and <VENUE>_SECRET."""
+    return load_exchange_class(venue)({
+        'apiKey': api_key or os.getenv(f"{venue.upper()}_API_KEY"),
+        'secret': secret or os.getenv(f"{venue.upper()}_SECRET"),
+    })
+
+
+class VenueRouter:
+    """Clients of several exchanges with the same ccxt interface, queried concurrently.
+
+    The first client is the primary venue. The pool has a few workers per venue, so concurrent
+    requests do not queue up behind each other and a slow venue only delays its own results.
+    """
+
+    def __init__(self, clients, markets_ttl=3600):
+        self.clients = dict(clients)
+        self.primary = next(iter(self.clients))
+        self.markets_ttl = markets_ttl
+        self.markets_loaded_at = {}
+        self.markets_lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(4 * len(self.clients), thread_name_prefix="Venue")
+
+    def map(self, fn, venues=None):
+        """Call fn(venue, client) for every venue concurrently and return the results by venue.
+
+        Raises the error of the first failing venue after all calls have finished.
+        """
+        venues = list(self.clients) if venues is None else list(venues)
+        if len(venues) == 1:
+            return {venues[0]: fn(venues[0], self.clients[venues[0]])}  # no hop through the pool
+        futures = {venue: self.executor.submit(fn, venue, self.clients[venue]) for venue in venues}
+        concurrent.futures.wait(futures.values())
+        return {venue: future.result() for venue, future in futures.items()}
+
+    def load_markets(self, venue):
+        """Load a venue's market metadata, reloading it once it is older than the TTL.
+
+        The metadata is kept on disk, so a restart within the TTL does not fetch it again.
+        """
+        client = self.clients[venue]
+        with self.markets_lock:
+            if venue not in self.markets_loaded_at:
+                self.markets_loaded_at[venue] = self.load_cached_markets(venue, client)
+            reload = time.time() - self.markets_loaded_at[venue] > self.markets_ttl
+            if reload:
+                self.markets_loaded_at[venue] = time.time()
+        markets = client.load_markets(reload=reload)  # ccxt keeps the markets in memory between calls
+        if reload:
+            self.save_cached_markets(venue, client)
+        return markets
+
+    def load_cached_markets(self, venue, client):
+        """Set a client's markets from the disk cache, returning when they were fetched or 0 if they were not cached."""
+        if not MARKETS_CACHE_DIR or not hasattr(client, "set_markets"):
+            return 0
+        path = os.path.join(MARKETS_CACHE_DIR, f"{venue}.json")
+        try:
+            fetched_at = os.path.getmtime(path)
+            if time.time() - fetched_at > self.markets_ttl:
+                return 0
+            with open(path) as file:
+                cache = json.load(file)
+            client.set_markets(cache["markets"], cache["currencies"])
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.warning(f"Error reading cached {venue} markets: {e}")
+            return 0
+        logger.info(f"Loaded {len(client.markets)} {venue} markets from the cache.")
+        return fetched_at
+
+    def save_cached_markets(self, venue, client):
+        """Write a client's markets and currencies to the disk cache."""
+        if not MARKETS_CACHE_DIR or not hasattr(client, "set_markets"):
+            return
+        path = os.path.join(MARKETS_CACHE_DIR, f"{venue}.json")
+        try:
+            os.makedirs(MARKETS_CACHE_DIR, exist_ok=True)
+            with open(f"{path}.tmp", 'w') as file:
+                json.dump({"markets": client.markets, "currencies": client.currencies}, file)
+            os.replace(f"{path}.tmp", path)  # readers never see a partial file
+        except Exception as e:
+            logger.warning(f"Error caching {venue} markets: {e}")
+
+    def warm_up(self):
+        """Load the market metadata of every venue, so the first order does not wait for it."""
+        def load(venue, client):
+            try:
+                self.load_markets(venue)
+            except Exception as e:
+                logger.warning(f"Error loading {venue} markets: {e}")
+
+        self.map(load)
+
+    def fee_rate(self, venue, symbol):
+        """Maker fee of a venue's market, ladder rungs rest on the book until they fill."""
+        fee_rate = os.getenv(f"{venue.upper()}_FEE_RATE")
+        if fee_rate is not None:
+            return float(fee_rate)
+        try:
+            fee_rate = self.load_markets(venue)[symbol].get('maker')
+        except Exception as e:
+            logger.warning(f"Error loading the {venue} fee for {symbol}: {e}")
+            fee_rate = None
+        return DEFAULT_FEE_RATE if fee_rate is None else float(fee_rate)
+
+    def fetch_tickers(self, symbol):
+        """Fetch a market's ticker from every venue concurrently, leaving out the venues that fail."""
+        def fetch(venue, client):
+            start = time.perf_counter()
+            try:
+                ticker = client.fetch_ticker(symbol)
+            except Exception as e:
+                logger.error(f"Error fetching {symbol} ticker from {venue}: {e}")
+                return None
+            logger.debug(f"Fetched {symbol} ticker from {venue}.", extra={"market": symbol, "venue": venue, "latency_ms": round((time.perf_counter() - start) * 1000, 3)})
+            return ticker
+
+        return {venue: ticker for venue, ticker in self.map(fetch).items() if ticker is not None}
+
+    def fetch_order_books(self, symbol, limit=None):
+        """Fetch a market's order book from every venue concurrently, leaving out the venues that fail."""
+        def fetch(venue, client):
+            try:
+                return client.fetch_order_book(symbol, limit)
+            except Exception as e:
+                logger.error(f"Error fetching {symbol} order book from {venue}: {e}")
+                return None
+
+        return {venue: order_book for venue, order_book in self.map(fetch).items() if order_book is not None}